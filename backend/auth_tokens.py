@@ -0,0 +1,140 @@
+"""JWT signing/verification with key rotation and an in-memory revocation list.
+
+Tokens are standard HS256 JWTs carrying a `kid` header, so the signing key
+can be rotated without invalidating tokens signed by previous keys: keys are
+configured as JWT_KEYS="kid1:secret1,kid2:secret2" and new tokens are signed
+with JWT_ACTIVE_KID. Without JWT_KEYS, SECRET_KEY is used under kid
+"default", which also verifies tokens issued before key rotation existed
+(they have no `kid` header).
+
+Once JWT_KEYS is set, SECRET_KEY is no longer a verification key. To keep
+tokens signed with it valid while they expire, list it explicitly as
+"default:<old secret>" in JWT_KEYS, and remove that entry to retire it.
+
+Verification is done with hmac/hashlib directly, which is a few
+microseconds per token and needs no third-party JWT library.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from typing import Dict, Iterable, Optional
+
+DEFAULT_KID = "default"
+
+
+class TokenError(Exception):
+    """Raised for malformed, badly signed, expired or wrong-type tokens"""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def parse_keys(spec: Optional[str], fallback_secret: str) -> Dict[str, bytes]:
+    """Parse "kid1:secret1,kid2:secret2" into {kid: secret}.
+
+    `fallback_secret` is only used, as kid "default", when the spec is empty.
+    """
+    keys = {}
+    for entry in (spec or "").split(","):
+        if not entry.strip():
+            continue
+        kid, _, secret = entry.partition(":")
+        if not secret:
+            raise ValueError(f"JWT_KEYS entry '{kid.strip()}' has no secret")
+        keys[kid.strip()] = secret.strip().encode()
+    return keys or {DEFAULT_KID: fallback_secret.encode()}
+
+
+class TokenSigner:
+    def __init__(self, keys: Dict[str, bytes], active_kid: str = DEFAULT_KID):
+        if active_kid not in keys:
+            raise ValueError(f"JWT_ACTIVE_KID '{active_kid}' is not in JWT_KEYS")
+        self.keys = keys
+        self.active_kid = active_kid
+
+    def encode(self, claims: dict, token_type: str, expires_in: int) -> str:
+        now = int(time.time())
+        header = {"alg": "HS256", "typ": "JWT", "kid": self.active_kid}
+        payload = {**claims, "typ": token_type, "iat": now, "exp": now + expires_in, "jti": uuid.uuid4().hex}
+        signing_input = (
+            _b64encode(json.dumps(header, separators=(",", ":")).encode())
+            + "."
+            + _b64encode(json.dumps(payload, separators=(",", ":")).encode())
+        )
+        signature = hmac.new(self.keys[self.active_kid], signing_input.encode(), hashlib.sha256).digest()
+        return signing_input + "." + _b64encode(signature)
+
+    def decode(self, token: str, token_type: str = "access") -> dict:
+        """Verify a token and return its claims.
+
+        The returned claims always contain `jti`; tokens issued without one
+        get a stable id derived from their signature, so they can still be
+        revoked.
+        """
+        try:
+            header_segment, payload_segment, signature_segment = token.split(".")
+            header = json.loads(_b64decode(header_segment))
+            signature = _b64decode(signature_segment)
+        except (ValueError, TypeError):
+            raise TokenError("Malformed token")
+        if not isinstance(header, dict):
+            raise TokenError("Malformed token")
+
+        if header.get("alg") != "HS256":
+            raise TokenError("Unsupported algorithm")
+        kid = header.get("kid", DEFAULT_KID)
+        key = self.keys.get(kid) if isinstance(kid, str) else None
+        if key is None:
+            raise TokenError("Unknown signing key")
+
+        expected = hmac.new(key, f"{header_segment}.{payload_segment}".encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(signature, expected):
+            raise TokenError("Invalid signature")
+
+        try:
+            payload = json.loads(_b64decode(payload_segment))
+        except ValueError:
+            raise TokenError("Malformed token")
+        if not isinstance(payload, dict) or not isinstance(payload.get("jti", ""), str):
+            raise TokenError("Malformed token")
+        if not isinstance(payload.get("exp"), (int, float)) or payload["exp"] <= time.time():
+            raise TokenError("Token expired")
+        # Tokens issued before refresh tokens existed have no typ and are access tokens
+        if payload.get("typ", "access") != token_type:
+            raise TokenError("Wrong token type")
+        payload.setdefault("jti", hashlib.sha256(signature).hexdigest()[:32])
+        return payload
+
+
+class RevocationList:
+    """Revoked token ids, checked without touching the database.
+
+    A plain set: membership is a single hash lookup (tens of nanoseconds),
+    which a Bloom filter implemented in Python cannot beat, and the TTL
+    index on revoked_tokens keeps it bounded to tokens that have not expired
+    yet. `replace` rebuilds it from the collection on every sync; `add`
+    records revocations made by this process immediately.
+    """
+
+    def __init__(self):
+        self._ids = set()
+
+    def replace(self, token_ids: Iterable[str]):
+        self._ids = set(token_ids)
+
+    def add(self, token_id: str):
+        self._ids.add(token_id)
+
+    def __contains__(self, token_id: str) -> bool:
+        return token_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
@@ -0,0 +1,112 @@
+"""Bottle-demand rollups and forecasts per delivery zone.
+
+Pure pandas/NumPy computation with no database access: server.py feeds it
+order documents and keeps the resulting rollup cached (see DemandForecaster).
+pandas and NumPy are imported inside the functions, so importing this module
+adds nothing to startup time.
+
+The zone of an order is the postal code of its delivery address ("CP 64000",
+"C.P. 64000", or otherwise the last five-digit number in the address).
+Addresses without one are grouped under UNKNOWN_ZONE.
+"""
+from datetime import date
+
+UNKNOWN_ZONE = "Sin zona"
+TOTAL_ZONE = "Total"
+POSTAL_CODE_PATTERN = r"(?i)\bC\.?\s?P\.?\s*(\d{5})\b"
+LAST_FIVE_DIGITS_PATTERN = r"(?s).*\b(\d{5})\b"
+
+
+def extract_zones(addresses):
+    """Map a Series of delivery addresses to zones (postal codes)"""
+    import pandas as pd
+    # Customers order to the same few addresses, so match each distinct one once
+    codes, unique = pd.factorize(addresses.fillna("").astype(str))
+    unique = pd.Series(unique, dtype=object)
+    zones = unique.str.extract(POSTAL_CODE_PATTERN, expand=False)
+    zones = zones.fillna(unique.str.extract(LAST_FIVE_DIGITS_PATTERN, expand=False))
+    return pd.Series(zones.fillna(UNKNOWN_ZONE).to_numpy()[codes], index=addresses.index)
+
+
+def empty_rollup():
+    import pandas as pd
+    index = pd.MultiIndex.from_arrays(
+        [pd.Index([], dtype=object), pd.DatetimeIndex([])], names=["zone", "day"]
+    )
+    return pd.Series([], index=index, dtype="int64", name="bottles")
+
+
+def daily_rollup(orders):
+    """Sum bottles per (zone, delivery day) over order documents.
+
+    Orders need quantity, delivery_address and delivery_date (YYYY-MM-DD);
+    a negative quantity removes an order counted before. Orders without a
+    valid delivery date are skipped.
+    """
+    import pandas as pd
+    if not orders:
+        return empty_rollup()
+    frame = pd.DataFrame.from_records(orders, columns=["quantity", "delivery_address", "delivery_date"])
+    frame["zone"] = extract_zones(frame["delivery_address"])
+    frame["day"] = pd.to_datetime(
+        frame["delivery_date"].astype(str).str.slice(0, 10), format="%Y-%m-%d", errors="coerce"
+    )
+    frame = frame.dropna(subset=["day"])
+    frame["quantity"] = pd.to_numeric(frame["quantity"], errors="coerce").fillna(0).astype("int64")
+    return frame.groupby(["zone", "day"])["quantity"].sum().rename("bottles")
+
+
+def merge_rollups(base, update):
+    """Add two rollups, dropping (zone, day) cells that cancel out"""
+    merged = base.add(update, fill_value=0).astype("int64")
+    return merged[merged != 0]
+
+
+def forecast(rollup, today: date, days: int = 7, weeks: int = 4,
+             history_weeks: int = 8, decay: float = 0.8) -> list:
+    """Forecast bottles per zone for the `days` days and `weeks` weeks from `today`.
+
+    The expected demand for a day is the mean of the same weekday over the
+    last `history_weeks` weeks, each week weighted `decay` times the one after
+    it. Orders already booked for a day are known demand, so a day's forecast
+    is never below them. Returns one entry per zone with recent orders, plus
+    a TOTAL_ZONE entry for all zones together.
+    """
+    import numpy as np
+    import pandas as pd
+
+    today = pd.Timestamp(today)
+    horizon = max(days, 7 * weeks)
+    history_days = 7 * history_weeks
+    all_days = pd.date_range(today - pd.Timedelta(days=history_days), periods=history_days + horizon, freq="D")
+
+    in_window = rollup[rollup.index.get_level_values("day").isin(all_days)]
+    table = in_window.unstack("day", fill_value=0).reindex(columns=all_days, fill_value=0)
+    matrix = table.to_numpy(dtype=float)
+    matrix = np.vstack([matrix, matrix.sum(axis=0, keepdims=True)])
+    zones = list(table.index) + [TOTAL_ZONE]
+
+    # history_days is a whole number of weeks, so column j of the history and
+    # day j of the horizon share a weekday whenever j % 7 matches
+    history = matrix[:, :history_days].reshape(len(zones), history_weeks, 7)
+    weights = decay ** np.arange(history_weeks - 1, -1, -1)
+    profile = np.tensordot(history, weights / weights.sum(), axes=([1], [0]))
+    booked = matrix[:, history_days:]
+    daily = np.maximum(profile[:, np.arange(horizon) % 7], booked)
+    weekly = daily[:, :7 * weeks].reshape(len(zones), weeks, 7).sum(axis=2)
+
+    dates = [day.date().isoformat() for day in all_days[history_days:]]
+    return [
+        {
+            "zone": zone,
+            "daily": [
+                {"date": dates[i], "bottles": round(float(daily[row, i]), 1), "booked": int(booked[row, i])}
+                for i in range(days)
+            ],
+            "weekly": [
+                {"week_start": dates[7 * i], "bottles": round(float(weekly[row, i]), 1)}
+                for i in range(weeks)
+            ],
+        }
+        for row, zone in enumerate(zones)
+    ]
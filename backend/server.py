@@ -1,42 +1,101 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from fastapi.responses import JSONResponse
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
+import csv
+import json
+import uuid
+import hashlib
 import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr, ConfigDict
-from typing import List, Optional
-from datetime import datetime, timezone, timedelta
-from passlib.context import CryptContext
-from jose import JWTError, jwt
+from pydantic import BaseModel, Field, EmailStr, ConfigDict, ValidationError
+from typing import Awaitable, Callable, Dict, List, Literal, Optional
+from datetime import date, datetime, timezone, timedelta
+from auth_tokens import DEFAULT_KID, RevocationList, TokenError, TokenSigner, parse_keys
+from compression import CompressionMiddleware
+
+# motor/pymongo and passlib are imported where they are first used rather
+# than here: together they account for a large share of import time and
+# neither is needed to build the app.
+# Run `python startup_profile.py` for the current import-time breakdown.
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection (opened in the app lifespan, see connect_db)
+client = None
+db = None
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production-123456789')
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 days
+ACCESS_TOKEN_EXPIRE_MINUTES = 15
+REFRESH_TOKEN_EXPIRE_DAYS = 30
+REVOCATION_SYNC_SECONDS = int(os.environ.get('REVOCATION_SYNC_SECONDS', '30'))
+
+# Signing keys: JWT_KEYS="kid1:secret1,kid2:secret2", new tokens use JWT_ACTIVE_KID
+token_signer = TokenSigner(
+    parse_keys(os.environ.get('JWT_KEYS'), SECRET_KEY),
+    os.environ.get('JWT_ACTIVE_KID', DEFAULT_KID)
+)
+revoked_tokens = RevocationList()
 
 security = HTTPBearer()
 
-# Create the main app
-app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 # Constants
 PRICE_PER_BOTTLE = 50  # MXN per bottle
+LOYALTY_MILESTONE = 5  # delivered orders per automatic loyalty coupon
+DASHBOARD_RECENT_ORDERS = 20  # orders kept in each customer summary
+IMPORT_CHUNK_SIZE = 1000  # rows validated, priced and inserted per batch
+IMPORT_MAX_REPORTED_ERRORS = 1000  # per-row errors returned in the import report
+IMPORT_MAX_ROW_BYTES = 64 * 1024  # longest accepted NDJSON line or CSV record
+IMPORT_COUPON_CLAIM_ATTEMPTS = 3  # reprice-and-retry rounds when a coupon is used concurrently
+COUPON_CACHE_TTL_SECONDS = int(os.environ.get('COUPON_CACHE_TTL_SECONDS', '60'))
+OUTBOX_FLUSH_SIZE = 500  # buffered events that trigger an immediate flush
+OUTBOX_FLUSH_SECONDS = float(os.environ.get('OUTBOX_FLUSH_SECONDS', '1'))
+OUTBOX_MAX_BUFFER = 100_000  # oldest events are dropped beyond this if Mongo is unreachable
+OUTBOX_DURABLE = os.environ.get('OUTBOX_DURABLE', 'true').lower() == 'true'
+OUTBOX_SHUTDOWN_TIMEOUT_SECONDS = 30
+# Allowed order status changes: pending -> in_transit -> delivered, and
+# cancellation until delivery. delivered and cancelled are final.
+ORDER_TRANSITIONS = {
+    "pending": ("in_transit", "cancelled"),
+    "in_transit": ("delivered", "cancelled"),
+    "delivered": (),
+    "cancelled": (),
+}
+ORDER_STATUS_LABELS = {
+    "pending": "Pendiente",
+    "in_transit": "En Camino",
+    "delivered": "Entregado",
+    "cancelled": "Cancelado",
+}
+SUBSCRIPTION_CADENCE_DAYS = {"weekly": 7, "biweekly": 14, "every_4_weeks": 28}
+SUBSCRIPTION_LEAD_DAYS = 1  # orders are materialised this many days before delivery
+SUBSCRIPTION_BATCH_SIZE = 1000  # due subscriptions materialised per round trip
+SUBSCRIPTION_POLL_SECONDS = int(os.environ.get('SUBSCRIPTION_POLL_SECONDS', '60'))
+SUBSCRIPTION_ORDER_NAMESPACE = uuid.UUID("6f1c2b0e-8a4d-4c55-9a57-0c6f3d0b7e21")
+FORECAST_HISTORY_WEEKS = 8  # weeks of history behind each weekday's expected demand
+FORECAST_WEEK_DECAY = 0.8  # weight of each history week relative to the next one
+FORECAST_MAX_DAYS = 31
+FORECAST_MAX_WEEKS = 12
+FORECAST_REBUILD_SECONDS = int(os.environ.get('FORECAST_REBUILD_SECONDS', '21600'))
+FORECAST_WATERMARK_OVERLAP_SECONDS = 60  # re-read window for orders committed out of order
+LIST_LIMIT = 1000  # documents returned by the list endpoints
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'false').lower() == 'true'
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))  # bytes
 
 # ==================== MODELS ====================
 
+
 class UserCreate(BaseModel):
     email: EmailStr
     password: str
@@ -59,14 +118,24 @@ class User(BaseModel):
 
 class Token(BaseModel):
     access_token: str
+    refresh_token: str
     token_type: str
+    expires_in: int
     user: User
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
+
 class CouponCreate(BaseModel):
     code: str = Field(min_length=3, max_length=20, description="Código del cupón")
     discount_percentage: int = Field(ge=1, le=100, description="Porcentaje de descuento")
     expiry_date: str
     max_uses: Optional[int] = None  # None = unlimited
+    min_quantity: Optional[int] = Field(default=None, ge=1, description="Garrafones mínimos por pedido")
+    per_customer_limit: Optional[int] = Field(default=None, ge=1, description="Usos máximos por cliente")
 
 class Coupon(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -76,10 +145,13 @@ class Coupon(BaseModel):
     is_active: bool
     max_uses: Optional[int]
     current_uses: int
+    min_quantity: Optional[int] = None
+    per_customer_limit: Optional[int] = None
     created_at: str
 
 class CouponValidate(BaseModel):
     code: str
+    quantity: Optional[int] = None
 
 class CouponValidateResponse(BaseModel):
     valid: bool
@@ -110,10 +182,90 @@ class Order(BaseModel):
     discount_percentage: int = 0
     original_total: float
     final_total: float
+    subscription_id: Optional[str] = None
     created_at: str
 
 class OrderUpdate(BaseModel):
-    status: str
+    status: Literal["pending", "in_transit", "delivered", "cancelled"]
+
+class SubscriptionCreate(BaseModel):
+    quantity: int = Field(gt=0, description="Cantidad de garrafones por entrega")
+    delivery_address: str
+    delivery_time: str
+    cadence: Literal["weekly", "biweekly", "every_4_weeks"] = "weekly"
+    start_date: str = Field(description="Fecha de la primera entrega (YYYY-MM-DD)")
+    notes: Optional[str] = ""
+
+class Subscription(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    customer_email: str
+    customer_name: str
+    customer_phone: str
+    quantity: int
+    delivery_address: str
+    delivery_time: str
+    cadence: str
+    notes: str
+    is_active: bool
+    next_delivery_date: str
+    next_run_at: str
+    created_at: str
+
+class LoyaltyProgress(BaseModel):
+    delivered_orders: int
+    next_milestone: int
+    orders_to_next_milestone: int
+
+class CustomerDashboard(BaseModel):
+    total_orders: int
+    pending_orders: int
+    delivered_orders: int
+    total_spent: float
+    total_bottles: int
+    recent_orders: List[Order]
+    coupons: List[Coupon]
+    loyalty: LoyaltyProgress
+
+class DailyForecast(BaseModel):
+    date: str
+    bottles: float
+    booked: int  # bottles already ordered for that day
+
+class WeeklyForecast(BaseModel):
+    week_start: str
+    bottles: float
+
+class ZoneForecast(BaseModel):
+    zone: str  # postal code of the delivery address
+    daily: List[DailyForecast]
+    weekly: List[WeeklyForecast]
+
+class DemandForecast(BaseModel):
+    generated_at: str
+    history_weeks: int
+    zones: List[ZoneForecast]
+    total: ZoneForecast
+
+class Event(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    type: str
+    actor: str
+    subject: str
+    data: dict
+    created_at: str
+
+class ImportRowError(BaseModel):
+    row: int
+    errors: List[str]
+
+class OrderImportResult(BaseModel):
+    total_rows: int
+    imported: int
+    failed: int
+    errors: List[ImportRowError]
+    errors_truncated: bool = False
 
 class CustomerInfo(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -124,39 +276,116 @@ class CustomerInfo(BaseModel):
     total_orders: int
     created_at: str
 
+# ==================== LIST RESPONSES ====================
+
+def parse_fields(fields: Optional[str], model) -> Optional[List[str]]:
+    """Validate a `fields=a,b,c` sparse fieldset against a response model"""
+    if fields is None:
+        return None
+    selected = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    if not selected:
+        raise HTTPException(status_code=400, detail="Indique al menos un campo en fields")
+    unknown = [name for name in selected if name not in model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campos no válidos: {', '.join(unknown)}")
+    return selected
+
+def columnar(rows: List[dict], columns: List[str]) -> dict:
+    """Encode rows column by column.
+
+    String columns that repeat values (status, customer name, address...)
+    are dictionary-encoded: each distinct value is sent once in `values` and
+    rows reference it by position in `indexes`.
+    """
+    encoded = {}
+    for column in columns:
+        values = [row.get(column) for row in rows]
+        if all(value is None or isinstance(value, str) for value in values):
+            positions = {}
+            indexes = [positions.setdefault(value, len(positions)) for value in values]
+            if len(positions) <= len(values) // 2:
+                encoded[column] = {"values": list(positions), "indexes": indexes}
+                continue
+        encoded[column] = values
+    return {"count": len(rows), "columns": encoded}
+
+def list_response(rows: List[dict], columns: List[str], response_format: str) -> JSONResponse:
+    if response_format == "columnar":
+        return JSONResponse(columnar(rows, columns))
+    return JSONResponse([{column: row.get(column) for column in columns} for row in rows])
+
 # ==================== AUTH UTILITIES ====================
 
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
-
-def create_access_token(data: dict):
-    to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
-
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="No se pudo validar las credenciales",
-        headers={"WWW-Authenticate": "Bearer"},
+    return get_pwd_context().hash(password)
+
+def create_tokens(email: str):
+    return {
+        "access_token": token_signer.encode({"sub": email}, "access", ACCESS_TOKEN_EXPIRE_MINUTES * 60),
+        "refresh_token": token_signer.encode({"sub": email}, "refresh", REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    }
+
+async def revoke_token(claims: dict) -> bool:
+    """Revoke a token by jti; returns False if it was already revoked"""
+    result = await db.revoked_tokens.update_one(
+        {"jti": claims["jti"]},
+        {"$setOnInsert": {
+            "jti": claims["jti"],
+            # BSON date so the TTL index drops the entry once the token expires anyway
+            "expires_at": datetime.fromtimestamp(claims["exp"], tz=timezone.utc),
+            "revoked_at": datetime.now(timezone.utc).isoformat()
+        }},
+        upsert=True
     )
+    revoked_tokens.add(claims["jti"])
+    return result.upserted_id is not None
+
+async def sync_revoked_tokens():
+    """Reload the in-memory revocation list, including other workers' revocations"""
+    revoked = await db.revoked_tokens.find(
+        {"expires_at": {"$gt": datetime.now(timezone.utc)}}, {"_id": 0, "jti": 1}
+    ).to_list(None)
+    revoked_tokens.replace(entry["jti"] for entry in revoked)
+
+async def run_revocation_sync():
+    while True:
+        await asyncio.sleep(REVOCATION_SYNC_SECONDS)
+        try:
+            await sync_revoked_tokens()
+        except Exception:
+            logger.exception("Revoked token sync failed")
+
+async def get_token_claims(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = await db.users.find_one({"email": email}, {"_id": 0, "password": 0})
+        claims = token_signer.decode(credentials.credentials, "access")
+    except TokenError:
+        claims = None
+    if claims is None or claims["jti"] in revoked_tokens:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="No se pudo validar las credenciales",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return claims
+
+async def get_current_user(claims: dict = Depends(get_token_claims)):
+    user = await db.users.find_one({"email": claims.get("sub")}, {"_id": 0, "password": 0})
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="No se pudo validar las credenciales",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
 async def get_current_admin(current_user: dict = Depends(get_current_user)):
@@ -167,6 +396,347 @@ async def get_current_admin(current_user: dict = Depends(get_current_user)):
         )
     return current_user
 
+# ==================== COUPON ENGINE ====================
+
+def customer_key(email: str) -> str:
+    """Stable field name for per-customer counters (emails contain dots)"""
+    return hashlib.sha1(email.lower().encode()).hexdigest()[:16]
+
+class CompiledCoupon:
+    """A coupon document with its rules compiled into predicates.
+
+    Each rule is a (predicate, message) pair evaluated in a fixed stacking
+    order: the first failing rule decides the rejection message, matching
+    the precedence the API has always used (expiry, then usage, then owner),
+    with the newer quantity and per-customer rules last.
+    """
+
+    def __init__(self, document: dict):
+        self.document = document
+        self.code = document["code"]
+        self.owner = document.get("customer_email")
+        self.rules = self._compile(document)
+
+    @staticmethod
+    def _compile(document: dict):
+        rules = []
+
+        expiry_dt = datetime.fromisoformat(document["expiry_date"])
+        if expiry_dt.tzinfo is None:
+            expiry_dt = expiry_dt.replace(tzinfo=timezone.utc)
+        rules.append((lambda email, quantity, now, used, used_by_customer: now < expiry_dt, "Cupón expirado"))
+
+        max_uses = document.get("max_uses")
+        if max_uses is not None:
+            remaining = max_uses - document.get("current_uses", 0)
+            rules.append((lambda email, quantity, now, used, used_by_customer: used < remaining, "Cupón agotado"))
+
+        owner = document.get("customer_email")
+        if owner:
+            rules.append((lambda email, quantity, now, used, used_by_customer: email == owner, "Este cupón no es válido para tu cuenta"))
+
+        min_quantity = document.get("min_quantity")
+        if min_quantity:
+            rules.append((
+                lambda email, quantity, now, used, used_by_customer: quantity is None or quantity >= min_quantity,
+                f"Este cupón requiere un pedido mínimo de {min_quantity} garrafones"
+            ))
+
+        per_customer_limit = document.get("per_customer_limit")
+        if per_customer_limit:
+            redemptions = document.get("redemptions", {})
+            rules.append((
+                lambda email, quantity, now, used, used_by_customer:
+                    redemptions.get(customer_key(email), 0) + used_by_customer < per_customer_limit,
+                "Ya usaste este cupón el máximo de veces permitido"
+            ))
+
+        return rules
+
+    def evaluate(self, customer_email: str, quantity: Optional[int] = None,
+                 now: Optional[datetime] = None, used: int = 0, used_by_customer: int = 0) -> Optional[str]:
+        """Return the rejection message, or None if the coupon applies.
+
+        `used` and `used_by_customer` count uses not yet written back, which
+        lets bulk callers evaluate many orders against one snapshot.
+        """
+        now = now or datetime.now(timezone.utc)
+        for predicate, message in self.rules:
+            if not predicate(customer_email, quantity, now, used, used_by_customer):
+                return message
+        return None
+
+class CouponEngine:
+    """In-memory cache of active coupons, compiled once per change.
+
+    Lookups never touch the database once the cache is warm. Writes that go
+    through this process (create, delete, redeem, loyalty coupons) update the
+    cache directly; a full reload every COUPON_CACHE_TTL_SECONDS picks up
+    changes made by other workers.
+    """
+
+    def __init__(self, ttl_seconds: int = COUPON_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._coupons = {}
+        self._by_owner = {}
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def reset(self):
+        """Drop the cache and rebind the lock to the running event loop"""
+        self._coupons = {}
+        self._by_owner = {}
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+
+    async def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+            return
+        async with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+                return
+            coupons = await db.coupons.find({"is_active": True}, {"_id": 0}).to_list(None)
+            self._coupons = {}
+            self._by_owner = {}
+            for coupon in coupons:
+                self.store(coupon)
+            self._loaded_at = time.monotonic()
+
+    def store(self, coupon: dict):
+        self.discard(coupon["code"])
+        if not coupon.get("is_active"):
+            return
+        compiled = CompiledCoupon({key: value for key, value in coupon.items() if key != "_id"})
+        self._coupons[compiled.code] = compiled
+        if compiled.owner:
+            self._by_owner.setdefault(compiled.owner, set()).add(compiled.code)
+
+    def discard(self, code: str):
+        compiled = self._coupons.pop(code, None)
+        if compiled and compiled.owner:
+            self._by_owner.get(compiled.owner, set()).discard(code)
+
+    async def get(self, code: str) -> Optional[CompiledCoupon]:
+        await self._ensure_loaded()
+        return self._coupons.get(code.upper())
+
+    async def for_customer(self, customer_email: str) -> List[dict]:
+        """Coupons owned by the customer that can still be redeemed"""
+        await self._ensure_loaded()
+        now = datetime.now(timezone.utc)
+        compiled_coupons = [self._coupons[code] for code in self._by_owner.get(customer_email, ())]
+        return [
+            compiled.document for compiled in compiled_coupons
+            if compiled.evaluate(customer_email, now=now) is None
+        ]
+
+    async def redeem(self, code: str, customer_email: str, quantity: int) -> Optional[dict]:
+        """Atomically consume one use of a coupon; returns the updated coupon.
+
+        The usage limits are repeated in the update filter, so concurrent
+        redemptions can never push a coupon past max_uses or a customer past
+        per_customer_limit even when every worker's cache says it applies.
+        """
+        compiled = await self.get(code)
+        if compiled is None or compiled.evaluate(customer_email, quantity) is not None:
+            return None
+
+        document = compiled.document
+        key = customer_key(customer_email)
+        query = {"code": compiled.code, "is_active": True}
+        update = {"$inc": {"current_uses": 1}}
+        if document.get("max_uses") is not None:
+            query["current_uses"] = {"$lt": document["max_uses"]}
+        if document.get("per_customer_limit"):
+            query["$or"] = [
+                {f"redemptions.{key}": {"$exists": False}},
+                {f"redemptions.{key}": {"$lt": document["per_customer_limit"]}}
+            ]
+            update["$inc"][f"redemptions.{key}"] = 1
+
+        from pymongo import ReturnDocument
+        updated = await db.coupons.find_one_and_update(
+            query, update, projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+        if updated is None:
+            # Another worker used it up; our snapshot is stale
+            self.invalidate()
+            return None
+        self.store(updated)
+        return updated
+
+    async def reload(self, code: str) -> Optional[CompiledCoupon]:
+        """Re-read one coupon, e.g. after a conditional write found it stale"""
+        coupon = await db.coupons.find_one({"code": code.upper()}, {"_id": 0})
+        if coupon is None:
+            self.discard(code.upper())
+            return None
+        self.store(coupon)
+        return self._coupons.get(coupon["code"])
+
+    async def claim_bulk_redemptions(self, compiled: CompiledCoupon, uses: Dict[str, int]) -> bool:
+        """Atomically consume several uses of a coupon: {email: count}.
+
+        Like `redeem`, the limits are part of the update filter, so the claim
+        fails as a whole (returning False) instead of pushing the coupon past
+        max_uses or a customer past per_customer_limit.
+        """
+        from pymongo import ReturnDocument
+        document = compiled.document
+        total = sum(uses.values())
+        query = {"code": compiled.code, "is_active": True}
+        update = {"$inc": {"current_uses": total}}
+        if document.get("max_uses") is not None:
+            query["current_uses"] = {"$lte": document["max_uses"] - total}
+        if document.get("per_customer_limit"):
+            query["$and"] = []
+            for email, count in uses.items():
+                field = f"redemptions.{customer_key(email)}"
+                query["$and"].append({"$or": [
+                    {field: {"$exists": False}},
+                    {field: {"$lte": document["per_customer_limit"] - count}}
+                ]})
+                update["$inc"][field] = count
+
+        updated = await db.coupons.find_one_and_update(
+            query, update, projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+        if updated is None:
+            return False
+        self.store(updated)
+        return True
+
+    async def release_bulk_redemptions(self, compiled: CompiledCoupon, uses: Dict[str, int]):
+        """Give back uses claimed for orders that were not saved"""
+        from pymongo import ReturnDocument
+        increments = {"current_uses": -sum(uses.values())}
+        if compiled.document.get("per_customer_limit"):
+            for email, count in uses.items():
+                increments[f"redemptions.{customer_key(email)}"] = -count
+        updated = await db.coupons.find_one_and_update(
+            {"code": compiled.code}, {"$inc": increments},
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+        if updated:
+            self.store(updated)
+
+coupon_engine = CouponEngine()
+
+# ==================== EVENT OUTBOX ====================
+
+class EventOutbox:
+    """Write-behind audit log for order and coupon mutations.
+
+    `emit` only appends to an in-process buffer, so request handlers never
+    wait on the audit write. A background task flushes the buffer to the
+    events collection with insert_many every OUTBOX_FLUSH_SECONDS, or as
+    soon as OUTBOX_FLUSH_SIZE events are pending. A batch that is not
+    written (failed or cancelled) goes back to the head of the buffer and is
+    retried on the next flush.
+
+    `close` stops the flush task after its current write rather than
+    cancelling it mid-write. In durable mode it then keeps retrying until
+    the buffer is written (up to OUTBOX_SHUTDOWN_TIMEOUT_SECONDS), so a
+    graceful shutdown does not finish with events still in memory; otherwise
+    it makes a single attempt.
+    """
+
+    def __init__(self, flush_size: int = OUTBOX_FLUSH_SIZE, flush_seconds: float = OUTBOX_FLUSH_SECONDS,
+                 max_buffer: int = OUTBOX_MAX_BUFFER, durable: bool = OUTBOX_DURABLE):
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self.durable = durable
+        self._buffer = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._stopping = False
+
+    def emit(self, event_type: str, actor: str, subject: str, data: Optional[dict] = None):
+        self._buffer.append({
+            "id": uuid.uuid4().hex,
+            "type": event_type,
+            "actor": actor,
+            "subject": subject,
+            "data": data or {},
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+        if len(self._buffer) > self.max_buffer:
+            dropped = len(self._buffer) - self.max_buffer
+            del self._buffer[:dropped]
+            logger.warning(f"Event outbox full, dropped {dropped} oldest events")
+        if len(self._buffer) >= self.flush_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        from pymongo.errors import BulkWriteError
+        async with self._flush_lock:
+            while self._buffer:
+                batch = self._buffer[:self.flush_size]
+                del self._buffer[:self.flush_size]
+                written = False
+                try:
+                    await db.events.insert_many(batch, ordered=False)
+                    written = True
+                except BulkWriteError as e:
+                    # insert_many assigns _id in place, so a retried batch only
+                    # collides with the events that were already written
+                    if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                        raise
+                    written = True
+                finally:
+                    # Also on cancellation, which is not an Exception
+                    if not written:
+                        self._buffer[:0] = batch
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception(f"Event outbox flush failed, {len(self._buffer)} events pending")
+
+    def start(self):
+        if self._task is None:
+            # Fresh primitives bound to the running event loop
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        deadline = time.monotonic() + OUTBOX_SHUTDOWN_TIMEOUT_SECONDS
+        if self._task is not None:
+            # Let the task finish its current write; it is only cancelled if
+            # that outlasts the deadline, and then flush re-queues the batch
+            self._stopping = True
+            self._wakeup.set()
+            await asyncio.gather(
+                asyncio.wait_for(self._task, timeout=max(deadline - time.monotonic(), 0)),
+                return_exceptions=True
+            )
+            self._task = None
+
+        while self._buffer:
+            try:
+                await self.flush()
+            except Exception:
+                if not self.durable or time.monotonic() >= deadline:
+                    logger.exception(f"Event outbox closed with {len(self._buffer)} unwritten events")
+                    return
+                await asyncio.sleep(min(self.flush_seconds, 1))
+
+event_outbox = EventOutbox()
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/register", response_model=Token)
@@ -190,10 +760,16 @@ async def register(user_data: UserCreate):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.users.insert_one(user_dict)
-    
-    # Create token
-    access_token = create_access_token(data={"sub": user_data.email})
+    from pymongo.errors import DuplicateKeyError
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        # A concurrent registration with the same email won the race
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El correo electrónico ya está registrado"
+        )
+    await db.customer_summaries.insert_one(empty_summary(user_dict["email"]))
     
     user_response = User(
         email=user_dict["email"],
@@ -204,7 +780,7 @@ async def register(user_data: UserCreate):
         created_at=user_dict["created_at"]
     )
     
-    return Token(access_token=access_token, token_type="bearer", user=user_response)
+    return Token(**create_tokens(user_dict["email"]), user=user_response)
 
 @api_router.post("/auth/login", response_model=Token)
 async def login(user_data: UserLogin):
@@ -215,8 +791,6 @@ async def login(user_data: UserLogin):
             detail="Correo o contraseña incorrectos"
         )
     
-    access_token = create_access_token(data={"sub": user_data.email})
-    
     user_response = User(
         email=user["email"],
         name=user["name"],
@@ -226,7 +800,41 @@ async def login(user_data: UserLogin):
         created_at=user["created_at"]
     )
     
-    return Token(access_token=access_token, token_type="bearer", user=user_response)
+    return Token(**create_tokens(user["email"]), user=user_response)
+
+@api_router.post("/auth/refresh", response_model=Token)
+async def refresh_tokens(refresh_data: RefreshRequest):
+    session_expired = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="La sesión expiró, inicie sesión nuevamente"
+    )
+    try:
+        claims = token_signer.decode(refresh_data.refresh_token, "refresh")
+    except TokenError:
+        raise session_expired
+    if claims["jti"] in revoked_tokens:
+        raise session_expired
+    
+    user = await db.users.find_one({"email": claims.get("sub")}, {"_id": 0, "password": 0})
+    if user is None:
+        raise session_expired
+    
+    # Refresh tokens are single use; revoking atomically also stops two
+    # concurrent refreshes with the same token from both succeeding
+    if not await revoke_token(claims):
+        raise session_expired
+    
+    return Token(**create_tokens(user["email"]), user=User(**user))
+
+@api_router.post("/auth/logout")
+async def logout(logout_data: Optional[LogoutRequest] = None, claims: dict = Depends(get_token_claims)):
+    await revoke_token(claims)
+    if logout_data and logout_data.refresh_token:
+        try:
+            await revoke_token(token_signer.decode(logout_data.refresh_token, "refresh"))
+        except TokenError:
+            pass
+    return {"message": "Sesión cerrada exitosamente"}
 
 @api_router.get("/auth/me", response_model=User)
 async def get_me(current_user: dict = Depends(get_current_user)):
@@ -234,43 +842,18 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 
 # ==================== ORDER ROUTES ====================
 
-@api_router.post("/orders", response_model=Order)
-async def create_order(order_data: OrderCreate, current_user: dict = Depends(get_current_user)):
-    import uuid
-    
-    # Calculate price
+def build_order_document(
+    order_data: OrderCreate,
+    customer: dict,
+    coupon_code: Optional[str] = None,
+    discount_percentage: int = 0
+):
     original_total = order_data.quantity * PRICE_PER_BOTTLE
-    discount_percentage = 0
-    final_total = original_total
-    coupon_code = None
-    
-    # Apply coupon if provided
-    if order_data.coupon_code:
-        coupon = await db.coupons.find_one({"code": order_data.coupon_code.upper()})
-        if coupon and coupon["is_active"]:
-            # Check expiry
-            expiry_dt = datetime.fromisoformat(coupon["expiry_date"])
-            if expiry_dt.tzinfo is None:
-                expiry_dt = expiry_dt.replace(tzinfo=timezone.utc)
-            
-            if expiry_dt > datetime.now(timezone.utc):
-                # Check max uses
-                if coupon["max_uses"] is None or coupon["current_uses"] < coupon["max_uses"]:
-                    discount_percentage = coupon["discount_percentage"]
-                    final_total = original_total * (1 - discount_percentage / 100)
-                    coupon_code = coupon["code"]
-                    
-                    # Increment coupon usage
-                    await db.coupons.update_one(
-                        {"code": coupon["code"]},
-                        {"$inc": {"current_uses": 1}}
-                    )
-    
-    order_dict = {
+    return {
         "id": str(uuid.uuid4()),
-        "customer_email": current_user["email"],
-        "customer_name": current_user["name"],
-        "customer_phone": current_user["phone"],
+        "customer_email": customer["email"],
+        "customer_name": customer["name"],
+        "customer_phone": customer["phone"],
         "quantity": order_data.quantity,
         "delivery_address": order_data.delivery_address,
         "delivery_date": order_data.delivery_date,
@@ -280,21 +863,409 @@ async def create_order(order_data: OrderCreate, current_user: dict = Depends(get
         "coupon_code": coupon_code,
         "discount_percentage": discount_percentage,
         "original_total": original_total,
-        "final_total": final_total,
+        "final_total": original_total * (1 - discount_percentage / 100),
         "created_at": datetime.now(timezone.utc).isoformat()
     }
+
+@api_router.post("/orders", response_model=Order)
+async def create_order(order_data: OrderCreate, current_user: dict = Depends(get_current_user)):
+    discount_percentage = 0
+    coupon_code = None
+    
+    # Apply coupon if provided; invalid coupons are ignored
+    if order_data.coupon_code:
+        coupon = await coupon_engine.redeem(order_data.coupon_code, current_user["email"], order_data.quantity)
+        if coupon:
+            discount_percentage = coupon["discount_percentage"]
+            coupon_code = coupon["code"]
+            event_outbox.emit("coupon.redeemed", current_user["email"], coupon_code, {"current_uses": coupon["current_uses"]})
+    
+    order_dict = build_order_document(order_data, current_user, coupon_code, discount_percentage)
     
     await db.orders.insert_one(order_dict)
+    await summary_record_orders([order_dict])
+    event_outbox.emit("order.created", current_user["email"], order_dict["id"], {
+        "quantity": order_dict["quantity"],
+        "final_total": order_dict["final_total"],
+        "coupon_code": coupon_code
+    })
     return Order(**order_dict)
 
+# ==================== ORDER STATUS HOOKS ====================
+
+# Side effects of a status change (events, summaries, loyalty coupons...)
+# register here instead of being called from the route. Hooks run after the
+# change is committed, in registration order, with hooks for every status
+# first; a failing hook is logged and does not affect the others.
+
+OrderStatusHook = Callable[[dict, str, str], Awaitable[None]]
+order_status_hooks: Dict[Optional[str], List[OrderStatusHook]] = {}
+
+def on_order_status(*statuses: str):
+    """Register `hook(order, previous_status, actor)` for changes into `statuses` (all if none given)"""
+    def register(hook: OrderStatusHook) -> OrderStatusHook:
+        for order_status in statuses or (None,):
+            order_status_hooks.setdefault(order_status, []).append(hook)
+        return hook
+    return register
+
+async def run_order_status_hooks(order: dict, previous_status: str, actor: str):
+    for hook in order_status_hooks.get(None, []) + order_status_hooks.get(order["status"], []):
+        try:
+            await hook(order, previous_status, actor)
+        except Exception:
+            logger.exception(f"Order status hook {hook.__name__} failed for order {order['id']}")
+
+@on_order_status()
+async def record_status_event(order: dict, previous_status: str, actor: str):
+    event_outbox.emit("order.status_changed", actor, order["id"], {
+        "from": previous_status,
+        "to": order["status"]
+    })
+
+# ==================== BULK ORDER IMPORT ====================
+
+async def iter_request_lines(request: Request):
+    """Yield the request body line by line, as bytes, without buffering it whole.
+
+    A line longer than IMPORT_MAX_ROW_BYTES is skipped and yielded as None,
+    so a body without newlines cannot grow the buffer without bound.
+    """
+    pending = b""
+    skipping = False
+    first = True
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if skipping:
+                # Tail of a line already reported as too long
+                skipping = False
+                continue
+            if first:
+                line = line.removeprefix(b"\xef\xbb\xbf")
+                first = False
+            yield None if len(line) > IMPORT_MAX_ROW_BYTES else line.rstrip(b"\r")
+        if len(pending) > IMPORT_MAX_ROW_BYTES:
+            if not skipping:
+                yield None
+            skipping = True
+            pending = b""
+    if pending and not skipping:
+        yield (pending.removeprefix(b"\xef\xbb\xbf") if first else pending).rstrip(b"\r")
+
+def decode_import_text(data: bytes) -> Optional[str]:
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+def csv_quote_open(line: bytes, in_quotes: bool) -> bool:
+    """Whether a quoted CSV field is still open at the end of `line`.
+
+    Follows the csv module's default dialect: a quote only opens a field at
+    the start of the field (elsewhere it is a literal character, as in
+    `3/4"`), and inside a quoted field `""` is an escaped quote.
+    """
+    position = 0
+    while True:
+        found = line.find(b'"', position)
+        if found < 0:
+            return in_quotes
+        if in_quotes:
+            if line[found + 1:found + 2] == b'"':
+                position = found + 2
+                continue
+            in_quotes = False
+        elif found == 0 or line[found - 1:found] == b",":
+            in_quotes = True
+        position = found + 1
+
+IMPORT_ROW_TOO_LONG = f"Fila demasiado larga (máximo {IMPORT_MAX_ROW_BYTES // 1024} KB)"
+IMPORT_INVALID_ENCODING = "Codificación inválida: guarde el archivo como UTF-8"
+
+async def iter_import_rows(request: Request, import_format: str):
+    """Yield one raw row per record in the body.
+
+    A raw row is a dict of column values, or an error message string when the
+    record itself could not be read. Undecodable bytes are reported rather
+    than replaced, so a cp1252 export never imports mangled accents.
+    """
+    if import_format == "ndjson":
+        async for line in iter_request_lines(request):
+            if line is None:
+                yield IMPORT_ROW_TOO_LONG
+                continue
+            if not line.strip():
+                continue
+            text = decode_import_text(line)
+            if text is None:
+                yield IMPORT_INVALID_ENCODING
+                continue
+            try:
+                raw = json.loads(text)
+            except json.JSONDecodeError as e:
+                yield f"JSON inválido: {e.msg}"
+                continue
+            yield raw if isinstance(raw, dict) else "Cada línea debe ser un objeto JSON"
+        return
+
+    # A quoted CSV cell may contain newlines, so lines are collected until
+    # no quoted field is left open and the complete record is then read by a
+    # single csv.reader. The reader only runs once a whole record is queued, so it
+    # never waits on the stream.
+    queued = deque()
+    reader = csv.reader(iter(queued.popleft, None))
+    header = None
+    record, record_bytes, in_quotes = [], 0, False
+    async for line in iter_request_lines(request):
+        if line is None or record_bytes + len(line) > IMPORT_MAX_ROW_BYTES:
+            if header is None:
+                raise HTTPException(status_code=400, detail="Encabezado CSV no válido")
+            record, record_bytes, in_quotes = [], 0, False
+            yield IMPORT_ROW_TOO_LONG
+            continue
+        if not record and not line.strip():
+            continue
+        record.append(line)
+        record_bytes += len(line) + 1
+        in_quotes = csv_quote_open(line, in_quotes)
+        if in_quotes:
+            continue  # inside a quoted cell
+        text = decode_import_text(b"\n".join(record))
+        record, record_bytes = [], 0
+        if text is None:
+            if header is None:
+                raise HTTPException(status_code=400, detail=f"Encabezado CSV no válido. {IMPORT_INVALID_ENCODING}")
+            yield IMPORT_INVALID_ENCODING
+            continue
+        queued.extend(part + "\n" for part in text.split("\n"))
+        values = next(reader)
+        if header is None:
+            header = [column.strip() for column in values]
+            continue
+        # Empty cells fall back to the model defaults
+        yield {column: value for column, value in zip(header, values) if value != ""}
+    if record:
+        yield "Comillas sin cerrar al final del archivo"
+
+async def iter_import_chunks(request: Request, import_format: str):
+    """Yield lists of (row_number, raw_row) tuples, IMPORT_CHUNK_SIZE at a time"""
+    chunk = []
+    row_number = 0
+    async for raw in iter_import_rows(request, import_format):
+        row_number += 1
+        chunk.append((row_number, raw))
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def price_coupon_rows(compiled: Optional[CompiledCoupon], rows: list, documents: list, now: datetime) -> Dict[str, int]:
+    """Apply a coupon to imported orders [(index, email, quantity)] in row order.
+
+    Each accepted row uses up part of the coupon's limits for the rows after
+    it. Rows the coupon no longer covers are priced without it. Returns the
+    uses consumed per customer email.
+    """
+    uses = {}
+    used = 0
+    for index, customer_email, quantity in rows:
+        document = documents[index]
+        applies = compiled is not None and compiled.evaluate(
+            customer_email, quantity, now, used=used, used_by_customer=uses.get(customer_email, 0)
+        ) is None
+        if applies:
+            uses[customer_email] = uses.get(customer_email, 0) + 1
+            used += 1
+            document["coupon_code"] = compiled.code
+            document["discount_percentage"] = compiled.document["discount_percentage"]
+        else:
+            document["coupon_code"] = None
+            document["discount_percentage"] = 0
+        document["final_total"] = document["original_total"] * (1 - document["discount_percentage"] / 100)
+    return uses
+
+async def import_order_chunk(rows: list, current_user: dict, report: dict):
+    """Validate, price and insert one chunk of imported rows.
+
+    Customers referenced by the chunk are fetched with a single query,
+    coupons come from the coupon engine's cache with one conditional claim
+    per code, and the priced orders are written with one insert_many.
+    """
+    from pymongo.errors import BulkWriteError
+    is_admin = current_user["role"] == "admin"
+
+    def add_error(row_number, messages):
+        report["failed"] += 1
+        if len(report["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+            report["errors"].append(ImportRowError(row=row_number, errors=messages))
+        else:
+            report["errors_truncated"] = True
+
+    # Validate every row against the same model used by POST /orders
+    validated = []
+    for row_number, raw in rows:
+        if isinstance(raw, str):
+            add_error(row_number, [raw])
+            continue
+        try:
+            order_data = OrderCreate.model_validate(raw)
+        except ValidationError as e:
+            add_error(row_number, [
+                f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+                for error in e.errors()
+            ])
+            continue
+        customer_email = str(raw.get("customer_email", "")).strip() if is_admin else None
+        if is_admin and not customer_email:
+            add_error(row_number, ["customer_email: requerido para importaciones de administrador"])
+            continue
+        validated.append((row_number, order_data, customer_email))
+
+    if not validated:
+        return
+
+    # Resolve customers in one query (admins import on behalf of customers)
+    if is_admin:
+        emails = list({customer_email for _, _, customer_email in validated})
+        customers = await db.users.find(
+            {"email": {"$in": emails}}, {"_id": 0, "password": 0}
+        ).to_list(None)
+        customers_by_email = {customer["email"]: customer for customer in customers}
+    else:
+        customers_by_email = {}
+
+    documents = []
+    document_rows = []
+    coupon_rows = {}
+    for row_number, order_data, customer_email in validated:
+        customer = customers_by_email.get(customer_email) if is_admin else current_user
+        if customer is None:
+            add_error(row_number, [f"customer_email: cliente no encontrado ({customer_email})"])
+            continue
+        if order_data.coupon_code:
+            coupon_rows.setdefault(order_data.coupon_code.upper(), []).append(
+                (len(documents), customer["email"], order_data.quantity)
+            )
+        documents.append(build_order_document(order_data, customer))
+        document_rows.append(row_number)
+
+    if not documents:
+        return
+
+    # Price each coupon's rows in order against one snapshot, then claim all
+    # their uses with one conditional write. If another request used the
+    # coupon meanwhile the claim fails; the coupon is reloaded and its rows
+    # repriced against the fresh counters.
+    now = datetime.now(timezone.utc)
+    claims = {}
+    for code, rows_for_code in coupon_rows.items():
+        compiled = await coupon_engine.get(code)
+        for _ in range(IMPORT_COUPON_CLAIM_ATTEMPTS):
+            # Without a coupon (e.g. deleted after a failed claim) the rows go back to full price
+            uses = price_coupon_rows(compiled, rows_for_code, documents, now)
+            if not uses or await coupon_engine.claim_bulk_redemptions(compiled, uses):
+                break
+            compiled = await coupon_engine.reload(code)
+        else:
+            uses = price_coupon_rows(None, rows_for_code, documents, now)
+        if uses:
+            claims[code] = compiled
+
+    failed_indexes = set()
+    duplicate_emails = set()
+    try:
+        await db.orders.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            failed_indexes.add(error["index"])
+            add_error(document_rows[error["index"]], [error.get("errmsg", "Error al guardar el pedido")])
+            if error.get("code") == 11000:
+                duplicate_emails.add(documents[error["index"]]["customer_email"])
+    imported = [document for index, document in enumerate(documents) if index not in failed_indexes]
+    imported_ids = [document["id"] for document in imported]
+    report["imported"] += len(imported_ids)
+
+    # Coupon uses only count for orders that were saved
+    for code, compiled in claims.items():
+        redeemed, released = {}, {}
+        for index, customer_email, _ in coupon_rows[code]:
+            if documents[index]["coupon_code"] == code:
+                counts = released if index in failed_indexes else redeemed
+                counts[customer_email] = counts.get(customer_email, 0) + 1
+        if released:
+            await coupon_engine.release_bulk_redemptions(compiled, released)
+        if redeemed:
+            event_outbox.emit("coupon.redeemed", current_user["email"], code, {"uses": sum(redeemed.values())})
+
+    await summary_record_orders(imported)
+    # The clashing order may come from a request that failed before
+    # updating its customer's summary
+    await summary_mark_stale(*duplicate_emails)
+    if imported_ids:
+        event_outbox.emit("orders.imported", current_user["email"], "orders", {"order_ids": imported_ids})
+
+@api_router.post("/orders/import", response_model=OrderImportResult)
+async def import_orders(
+    request: Request,
+    format: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Bulk-create orders from a CSV or NDJSON request body.
+
+    Columns/keys match OrderCreate; admins must also send customer_email on
+    every row. The body is read as a stream and processed in chunks of
+    IMPORT_CHUNK_SIZE rows, so large files never sit in memory at once.
+    """
+    import_format = (format or "").lower()
+    if not import_format:
+        content_type = request.headers.get("content-type", "")
+        if "csv" in content_type:
+            import_format = "csv"
+        elif "ndjson" in content_type or "jsonl" in content_type or "json" in content_type:
+            import_format = "ndjson"
+    if import_format not in ("csv", "ndjson"):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Formato no soportado. Use text/csv o application/x-ndjson"
+        )
+
+    report = {"total_rows": 0, "imported": 0, "failed": 0, "errors": [], "errors_truncated": False}
+    async for rows in iter_import_chunks(request, import_format):
+        report["total_rows"] += len(rows)
+        await import_order_chunk(rows, current_user, report)
+
+    report["errors"].sort(key=lambda error: error.row)
+    return OrderImportResult(**report)
+
 @api_router.get("/orders", response_model=List[Order])
-async def get_orders(current_user: dict = Depends(get_current_user)):
+async def get_orders(
+    fields: Optional[str] = None,
+    format: Literal["json", "columnar"] = "json",
+    current_user: dict = Depends(get_current_user)
+):
+    """List orders, newest first.
+
+    `fields=id,status,quantity` returns only those fields (the projection is
+    applied in Mongo) and `format=columnar` returns the rows column by column.
+    """
     query = {}
     if current_user["role"] != "admin":
         query["customer_email"] = current_user["email"]
     
-    orders = await db.orders.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return [Order(**order) for order in orders]
+    selected = parse_fields(fields, Order)
+    projection = {"_id": 0}
+    if selected:
+        projection.update({field: 1 for field in selected})
+    orders = await db.orders.find(query, projection).sort("created_at", -1).to_list(LIST_LIMIT)
+    if selected is None:
+        orders = [Order(**order) for order in orders]
+        if format == "json":
+            return orders
+        orders = [order.model_dump() for order in orders]
+    return list_response(orders, selected or list(Order.model_fields), format)
 
 @api_router.get("/orders/{order_id}", response_model=Order)
 async def get_order(order_id: str, current_user: dict = Depends(get_current_user)):
@@ -314,49 +1285,401 @@ async def update_order_status(
     update_data: OrderUpdate, 
     current_user: dict = Depends(get_current_admin)
 ):
-    order = await db.orders.find_one({"id": order_id})
-    if not order:
-        raise HTTPException(status_code=404, detail="Pedido no encontrado")
+    new_status = update_data.status
+    sources = [source for source, targets in ORDER_TRANSITIONS.items() if new_status in targets]
     
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {"status": update_data.status}}
+    # The transition check is part of the update filter, so two admins
+    # racing on the same order cannot both apply a change
+    from pymongo import ReturnDocument
+    previous = await db.orders.find_one_and_update(
+        {"id": order_id, "status": {"$in": sources}},
+        {"$set": {"status": new_status}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
     )
+    if previous is None:
+        # Only failed transitions pay for a second read, to say why
+        current = await db.orders.find_one({"id": order_id}, {"_id": 0})
+        if current is None:
+            raise HTTPException(status_code=404, detail="Pedido no encontrado")
+        if current["status"] == new_status:
+            return Order(**current)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=(
+                f"No se puede cambiar un pedido {ORDER_STATUS_LABELS.get(current['status'], current['status'])} "
+                f"a {ORDER_STATUS_LABELS[new_status]}"
+            )
+        )
     
-    # If order is marked as delivered, check if customer qualifies for auto coupon
-    if update_data.status == "delivered":
-        await generate_loyalty_coupon(order["customer_email"])
-    
-    updated_order = await db.orders.find_one({"id": order_id}, {"_id": 0})
-    return Order(**updated_order)
+    order = {**previous, "status": new_status}
+    await run_order_status_hooks(order, previous["status"], current_user["email"])
+    return Order(**order)
 
 @api_router.delete("/orders/{order_id}")
 async def delete_order(order_id: str, current_user: dict = Depends(get_current_admin)):
-    result = await db.orders.delete_one({"id": order_id})
-    if result.deleted_count == 0:
+    order = await db.orders.find_one_and_delete({"id": order_id}, projection={"_id": 0})
+    if order is None:
         raise HTTPException(status_code=404, detail="Pedido no encontrado")
+    await summary_mark_stale(order["customer_email"])
+    if order["status"] != "cancelled":
+        demand_forecaster.subtract(order)
+    event_outbox.emit("order.deleted", current_user["email"], order_id, {
+        "customer_email": order["customer_email"],
+        "status": order["status"],
+        "quantity": order["quantity"]
+    })
     return {"message": "Pedido eliminado exitosamente"}
 
+# ==================== CUSTOMER SUMMARIES ====================
+
+# One document per customer in customer_summaries, kept up to date on every
+# order write so the dashboard is a single point read. Summaries flagged
+# needs_rebuild (or missing, for customers who predate them) are rebuilt from
+# the orders collection on the next read. Every incremental write bumps the
+# summary's version, so a rebuild only saves its result if no write landed
+# while it was reading the orders.
+
+def empty_summary(customer_email: str):
+    return {
+        "customer_email": customer_email,
+        "total_orders": 0,
+        "status_counts": {},
+        "total_spent": 0,
+        "total_bottles": 0,
+        "recent_orders": [],
+        "needs_rebuild": False,
+        "version": 0
+    }
+
+def summary_order(order: dict):
+    return {key: value for key, value in order.items() if key != "_id"}
+
+async def summary_record_orders(orders: List[dict]):
+    """Fold newly created orders into their customers' summaries"""
+    from pymongo import UpdateOne
+    by_customer = {}
+    for order in orders:
+        by_customer.setdefault(order["customer_email"], []).append(order)
+
+    updates = []
+    for customer_email, customer_orders in by_customer.items():
+        customer_orders.sort(key=lambda order: order["created_at"], reverse=True)
+        increments = {
+            "total_orders": len(customer_orders),
+            "total_spent": sum(order["final_total"] for order in customer_orders),
+            "total_bottles": sum(order["quantity"] for order in customer_orders),
+            "version": 1
+        }
+        for order in customer_orders:
+            key = f"status_counts.{order['status']}"
+            increments[key] = increments.get(key, 0) + 1
+        updates.append(UpdateOne(
+            {"customer_email": customer_email},
+            {
+                "$inc": increments,
+                "$push": {"recent_orders": {
+                    "$each": [summary_order(order) for order in customer_orders[:DASHBOARD_RECENT_ORDERS]],
+                    "$position": 0,
+                    "$slice": DASHBOARD_RECENT_ORDERS
+                }},
+                # A summary created here is missing the customer's older orders
+                "$setOnInsert": {"needs_rebuild": True}
+            },
+            upsert=True
+        ))
+    if updates:
+        await db.customer_summaries.bulk_write(updates, ordered=False)
+
+async def summary_record_status_change(order: dict, previous_status: str):
+    increments = {
+        f"status_counts.{previous_status}": -1,
+        f"status_counts.{order['status']}": 1,
+        "version": 1
+    }
+    # Cancelled orders do not count towards spend
+    if order["status"] == "cancelled" and previous_status != "cancelled":
+        increments["total_spent"] = -order["final_total"]
+        increments["total_bottles"] = -order["quantity"]
+    elif previous_status == "cancelled" and order["status"] != "cancelled":
+        increments["total_spent"] = order["final_total"]
+        increments["total_bottles"] = order["quantity"]
+    await db.customer_summaries.update_one(
+        {"customer_email": order["customer_email"]},
+        {"$inc": increments, "$set": {"recent_orders.$[o].status": order["status"]}},
+        array_filters=[{"o.id": order["id"]}]
+    )
+
+@on_order_status()
+async def summary_status_hook(order: dict, previous_status: str, actor: str):
+    await summary_record_status_change(order, previous_status)
+
+async def summary_mark_stale(*customer_emails: str):
+    if customer_emails:
+        await db.customer_summaries.update_many(
+            {"customer_email": {"$in": list(set(customer_emails))}},
+            {"$set": {"needs_rebuild": True}, "$inc": {"version": 1}}
+        )
+
+async def rebuild_customer_summary(customer_email: str, version: Optional[int] = None):
+    """Recompute a summary from the orders collection.
+
+    `version` is the summary version read before the rebuild started (None
+    if there was no summary). The result is only saved if the version is
+    unchanged; otherwise an incremental write raced with the rebuild, and
+    the summary stays flagged for the next read.
+    """
+    from pymongo.errors import DuplicateKeyError
+    totals = await db.orders.aggregate([
+        {"$match": {"customer_email": customer_email}},
+        {"$group": {
+            "_id": "$status",
+            "count": {"$sum": 1},
+            "spent": {"$sum": "$final_total"},
+            "bottles": {"$sum": "$quantity"}
+        }}
+    ]).to_list(None)
+    recent = await db.orders.find(
+        {"customer_email": customer_email}, {"_id": 0}
+    ).sort("created_at", -1).limit(DASHBOARD_RECENT_ORDERS).to_list(DASHBOARD_RECENT_ORDERS)
+
+    summary = empty_summary(customer_email)
+    summary["recent_orders"] = recent
+    for group in totals:
+        summary["status_counts"][group["_id"]] = group["count"]
+        summary["total_orders"] += group["count"]
+        if group["_id"] != "cancelled":
+            summary["total_spent"] += group["spent"]
+            summary["total_bottles"] += group["bottles"]
+
+    summary["version"] = version or 0
+    try:
+        await db.customer_summaries.update_one(
+            # Summaries written before versioning have no version field
+            {"customer_email": customer_email, "version": version or {"$in": [0, None]}},
+            {"$set": summary},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        pass  # the version moved on, so the filter missed and the upsert collided
+    return summary
+
+@api_router.get("/me/dashboard", response_model=CustomerDashboard)
+async def get_my_dashboard(current_user: dict = Depends(get_current_user)):
+    summary = await db.customer_summaries.find_one({"customer_email": current_user["email"]}, {"_id": 0})
+    if summary is None or summary.get("needs_rebuild"):
+        summary = await rebuild_customer_summary(
+            current_user["email"], summary.get("version", 0) if summary else None
+        )
+
+    status_counts = summary["status_counts"]
+    delivered = status_counts.get("delivered", 0)
+    next_milestone = (delivered // LOYALTY_MILESTONE + 1) * LOYALTY_MILESTONE
+    coupons = await coupon_engine.for_customer(current_user["email"])
+
+    return CustomerDashboard(
+        total_orders=summary["total_orders"],
+        pending_orders=status_counts.get("pending", 0),
+        delivered_orders=delivered,
+        total_spent=summary["total_spent"],
+        total_bottles=summary["total_bottles"],
+        recent_orders=[Order(**order) for order in summary["recent_orders"]],
+        coupons=[Coupon(**coupon) for coupon in coupons],
+        loyalty=LoyaltyProgress(
+            delivered_orders=delivered,
+            next_milestone=next_milestone,
+            orders_to_next_milestone=next_milestone - delivered
+        )
+    )
+
+# ==================== SUBSCRIPTIONS ====================
+
+def subscription_run_at(delivery_date: date) -> str:
+    """When the order for a delivery date should be materialised"""
+    run_at = datetime.combine(delivery_date, datetime.min.time(), tzinfo=timezone.utc)
+    return (run_at - timedelta(days=SUBSCRIPTION_LEAD_DAYS)).isoformat()
+
+def subscription_order_document(subscription: dict):
+    """Order for the subscription's next delivery.
+
+    The id is derived from the subscription and delivery date, so
+    materialising the same occurrence twice yields a duplicate key instead
+    of a second order.
+    """
+    delivery_date = subscription["next_delivery_date"]
+    original_total = subscription["quantity"] * PRICE_PER_BOTTLE
+    return {
+        "id": str(uuid.uuid5(SUBSCRIPTION_ORDER_NAMESPACE, f"{subscription['id']}:{delivery_date}")),
+        "customer_email": subscription["customer_email"],
+        "customer_name": subscription["customer_name"],
+        "customer_phone": subscription["customer_phone"],
+        "quantity": subscription["quantity"],
+        "delivery_address": subscription["delivery_address"],
+        "delivery_date": delivery_date,
+        "delivery_time": subscription["delivery_time"],
+        "notes": subscription["notes"],
+        "status": "pending",
+        "coupon_code": None,
+        "discount_percentage": 0,
+        "original_total": original_total,
+        "final_total": original_total,
+        "subscription_id": subscription["id"],
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+def advance_subscription(subscription: dict, now: datetime):
+    """Move a subscription past `now`, skipping occurrences that were missed"""
+    from pymongo import UpdateOne
+    cadence = timedelta(days=SUBSCRIPTION_CADENCE_DAYS[subscription["cadence"]])
+    delivery_date = date.fromisoformat(subscription["next_delivery_date"]) + cadence
+    while subscription_run_at(delivery_date) <= now.isoformat():
+        delivery_date += cadence
+    return UpdateOne(
+        # Conditional on the run we materialised, so concurrent schedulers advance once
+        {"id": subscription["id"], "next_run_at": subscription["next_run_at"]},
+        {"$set": {
+            "next_delivery_date": delivery_date.isoformat(),
+            "next_run_at": subscription_run_at(delivery_date)
+        }}
+    )
+
+async def materialise_due_subscriptions(now: Optional[datetime] = None) -> int:
+    """Create orders for every subscription whose next run is due.
+
+    Due subscriptions are read through the (is_active, next_run_at) index in
+    batches; each batch costs one insert_many and one bulk_write. If a run is
+    interrupted after inserting orders but before advancing the
+    subscriptions, the next run re-creates the same order ids, which the
+    unique index on orders.id rejects, and then advances them.
+    """
+    from pymongo.errors import BulkWriteError
+    now = now or datetime.now(timezone.utc)
+    created = 0
+    while True:
+        due = await db.subscriptions.find(
+            {"is_active": True, "next_run_at": {"$lte": now.isoformat()}},
+            {"_id": 0}
+        ).sort("next_run_at", 1).limit(SUBSCRIPTION_BATCH_SIZE).to_list(SUBSCRIPTION_BATCH_SIZE)
+        if not due:
+            return created
+
+        orders = [subscription_order_document(subscription) for subscription in due]
+        duplicates = set()
+        try:
+            await db.orders.insert_many(orders, ordered=False)
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in write_errors):
+                raise
+            duplicates = {error["index"] for error in write_errors}
+        created_orders = [order for index, order in enumerate(orders) if index not in duplicates]
+        created_ids = [order["id"] for order in created_orders]
+        created += len(created_ids)
+        await summary_record_orders(created_orders)
+        # A duplicate was inserted by an interrupted run, which may have
+        # stopped before adding it to the customer's summary
+        await summary_mark_stale(*(orders[index]["customer_email"] for index in duplicates))
+        if created_ids:
+            event_outbox.emit("orders.materialised", "system", "subscriptions", {"order_ids": created_ids})
+
+        await db.subscriptions.bulk_write(
+            [advance_subscription(subscription, now) for subscription in due],
+            ordered=False
+        )
+
+async def run_subscription_scheduler():
+    while True:
+        try:
+            created = await materialise_due_subscriptions()
+            if created:
+                logger.info(f"Materialised {created} subscription orders")
+        except Exception:
+            logger.exception("Subscription scheduler run failed")
+        await asyncio.sleep(SUBSCRIPTION_POLL_SECONDS)
+
+@api_router.post("/subscriptions", response_model=Subscription)
+async def create_subscription(
+    subscription_data: SubscriptionCreate,
+    current_user: dict = Depends(get_current_user)
+):
+    try:
+        start_date = date.fromisoformat(subscription_data.start_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fecha de inicio inválida (use YYYY-MM-DD)")
+    if start_date < datetime.now(timezone.utc).date():
+        raise HTTPException(status_code=400, detail="La fecha de inicio no puede estar en el pasado")
+
+    subscription_dict = {
+        "id": str(uuid.uuid4()),
+        "customer_email": current_user["email"],
+        "customer_name": current_user["name"],
+        "customer_phone": current_user["phone"],
+        "quantity": subscription_data.quantity,
+        "delivery_address": subscription_data.delivery_address,
+        "delivery_time": subscription_data.delivery_time,
+        "cadence": subscription_data.cadence,
+        "notes": subscription_data.notes or "",
+        "is_active": True,
+        "next_delivery_date": start_date.isoformat(),
+        "next_run_at": subscription_run_at(start_date),
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+    await db.subscriptions.insert_one(subscription_dict)
+    return Subscription(**subscription_dict)
+
+@api_router.get("/subscriptions", response_model=List[Subscription])
+async def get_subscriptions(current_user: dict = Depends(get_current_user)):
+    query = {}
+    if current_user["role"] != "admin":
+        query["customer_email"] = current_user["email"]
+
+    subscriptions = await db.subscriptions.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    return [Subscription(**subscription) for subscription in subscriptions]
+
+@api_router.delete("/subscriptions/{subscription_id}")
+async def cancel_subscription(subscription_id: str, current_user: dict = Depends(get_current_user)):
+    query = {"id": subscription_id}
+    if current_user["role"] != "admin":
+        query["customer_email"] = current_user["email"]
+
+    result = await db.subscriptions.update_one(query, {"$set": {"is_active": False}})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Suscripción no encontrada")
+    event_outbox.emit("subscription.cancelled", current_user["email"], subscription_id)
+    return {"message": "Suscripción cancelada exitosamente"}
+
 # ==================== CUSTOMER ROUTES (Admin only) ====================
 
 @api_router.get("/customers", response_model=List[CustomerInfo])
-async def get_customers(current_user: dict = Depends(get_current_admin)):
-    users = await db.users.find({"role": "customer"}, {"_id": 0, "password": 0}).to_list(1000)
+async def get_customers(
+    fields: Optional[str] = None,
+    format: Literal["json", "columnar"] = "json",
+    current_user: dict = Depends(get_current_admin)
+):
+    """List customers with their order count; supports `fields` and `format` like /orders"""
+    selected = parse_fields(fields, CustomerInfo)
+    columns = selected or list(CustomerInfo.model_fields)
+    projection = {"_id": 0, "email": 1}
+    projection.update({field: 1 for field in columns if field != "total_orders"})
+    users = await db.users.find({"role": "customer"}, projection).to_list(LIST_LIMIT)
     
-    customers_with_orders = []
-    for user in users:
-        order_count = await db.orders.count_documents({"customer_email": user["email"]})
-        customer_info = CustomerInfo(
-            email=user["email"],
-            name=user["name"],
-            phone=user["phone"],
-            address=user["address"],
-            total_orders=order_count,
-            created_at=user["created_at"]
-        )
-        customers_with_orders.append(customer_info)
+    if "total_orders" in columns:
+        # One grouped count for every listed customer instead of a query per customer
+        groups = await db.orders.aggregate([
+            {"$match": {"customer_email": {"$in": [user["email"] for user in users]}}},
+            {"$group": {"_id": "$customer_email", "count": {"$sum": 1}}}
+        ]).to_list(None)
+        order_counts = {group["_id"]: group["count"] for group in groups}
+        for user in users:
+            user["total_orders"] = order_counts.get(user["email"], 0)
     
-    return customers_with_orders
+    if selected is None:
+        customers = [CustomerInfo(**user) for user in users]
+        if format == "json":
+            return customers
+        users = [customer.model_dump() for customer in customers]
+    return list_response(users, columns, format)
 
 @api_router.get("/stats")
 async def get_stats(current_user: dict = Depends(get_current_user)):
@@ -394,7 +1717,7 @@ async def generate_loyalty_coupon(customer_email: str):
     })
     
     # Generate coupon at 5, 10, 15, 20... delivered orders
-    if delivered_count > 0 and delivered_count % 5 == 0:
+    if delivered_count > 0 and delivered_count % LOYALTY_MILESTONE == 0:
         # Check if coupon already exists for this milestone
         coupon_code = f"LOYAL{delivered_count}_{customer_email.split('@')[0].upper()[:5]}"
         existing = await db.coupons.find_one({"code": coupon_code})
@@ -411,7 +1734,17 @@ async def generate_loyalty_coupon(customer_email: str):
                 "customer_email": customer_email,
                 "created_at": datetime.now(timezone.utc).isoformat()
             }
-            await db.coupons.insert_one(coupon_dict)
+            from pymongo.errors import DuplicateKeyError
+            try:
+                await db.coupons.insert_one(coupon_dict)
+            except DuplicateKeyError:
+                return  # created by a concurrent delivery of the same milestone
+            coupon_engine.store(coupon_dict)
+            event_outbox.emit("coupon.created", "system", coupon_code, {"reason": "loyalty", "customer_email": customer_email})
+
+@on_order_status("delivered")
+async def loyalty_status_hook(order: dict, previous_status: str, actor: str):
+    await generate_loyalty_coupon(order["customer_email"])
 
 @api_router.post("/coupons", response_model=Coupon)
 async def create_coupon(coupon_data: CouponCreate, current_user: dict = Depends(get_current_admin)):
@@ -433,10 +1766,24 @@ async def create_coupon(coupon_data: CouponCreate, current_user: dict = Depends(
         "is_active": True,
         "max_uses": coupon_data.max_uses,
         "current_uses": 0,
+        "min_quantity": coupon_data.min_quantity,
+        "per_customer_limit": coupon_data.per_customer_limit,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.coupons.insert_one(coupon_dict)
+    from pymongo.errors import DuplicateKeyError
+    try:
+        await db.coupons.insert_one(coupon_dict)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El código de cupón ya existe"
+        )
+    coupon_engine.store(coupon_dict)
+    event_outbox.emit("coupon.created", current_user["email"], coupon_dict["code"], {
+        "discount_percentage": coupon_dict["discount_percentage"],
+        "max_uses": coupon_dict["max_uses"]
+    })
     return Coupon(**coupon_dict)
 
 @api_router.get("/coupons", response_model=List[Coupon])
@@ -447,86 +1794,225 @@ async def get_coupons(current_user: dict = Depends(get_current_admin)):
 @api_router.delete("/coupons/{code}")
 async def delete_coupon(code: str, current_user: dict = Depends(get_current_admin)):
     result = await db.coupons.delete_one({"code": code.upper()})
+    coupon_engine.discard(code.upper())
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Cupón no encontrado")
+    event_outbox.emit("coupon.deleted", current_user["email"], code.upper())
     return {"message": "Cupón eliminado exitosamente"}
 
 @api_router.post("/coupons/validate", response_model=CouponValidateResponse)
 async def validate_coupon(coupon_data: CouponValidate, current_user: dict = Depends(get_current_user)):
-    coupon = await db.coupons.find_one({"code": coupon_data.code.upper()})
+    compiled = await coupon_engine.get(coupon_data.code)
     
-    if not coupon:
+    if compiled is None:
         return CouponValidateResponse(
             valid=False,
             discount_percentage=0,
             message="Cupón no encontrado"
         )
     
-    if not coupon["is_active"]:
+    rejection = compiled.evaluate(current_user["email"], coupon_data.quantity)
+    if rejection:
         return CouponValidateResponse(
             valid=False,
             discount_percentage=0,
-            message="Cupón inactivo"
-        )
-    
-    # Check expiry
-    expiry_dt = datetime.fromisoformat(coupon["expiry_date"])
-    if expiry_dt.tzinfo is None:
-        expiry_dt = expiry_dt.replace(tzinfo=timezone.utc)
-    
-    if expiry_dt <= datetime.now(timezone.utc):
-        return CouponValidateResponse(
-            valid=False,
-            discount_percentage=0,
-            message="Cupón expirado"
-        )
-    
-    # Check max uses
-    if coupon["max_uses"] is not None and coupon["current_uses"] >= coupon["max_uses"]:
-        return CouponValidateResponse(
-            valid=False,
-            discount_percentage=0,
-            message="Cupón agotado"
-        )
-    
-    # Check if it's a customer-specific coupon
-    if "customer_email" in coupon and coupon["customer_email"] != current_user["email"]:
-        return CouponValidateResponse(
-            valid=False,
-            discount_percentage=0,
-            message="Este cupón no es válido para tu cuenta"
+            message=rejection
         )
     
+    discount_percentage = compiled.document["discount_percentage"]
     return CouponValidateResponse(
         valid=True,
-        discount_percentage=coupon["discount_percentage"],
-        message=f"¡Cupón válido! {coupon['discount_percentage']}% de descuento"
+        discount_percentage=discount_percentage,
+        message=f"¡Cupón válido! {discount_percentage}% de descuento"
     )
 
 @api_router.get("/coupons/my-coupons", response_model=List[Coupon])
 async def get_my_coupons(current_user: dict = Depends(get_current_user)):
-    # Get customer-specific coupons that are still valid
-    coupons = await db.coupons.find({
-        "customer_email": current_user["email"],
-        "is_active": True
-    }, {"_id": 0}).to_list(1000)
-    
-    # Filter out expired or fully used coupons
-    valid_coupons = []
-    for coupon in coupons:
-        expiry_dt = datetime.fromisoformat(coupon["expiry_date"])
-        if expiry_dt.tzinfo is None:
-            expiry_dt = expiry_dt.replace(tzinfo=timezone.utc)
-        
-        if expiry_dt > datetime.now(timezone.utc):
-            if coupon["max_uses"] is None or coupon["current_uses"] < coupon["max_uses"]:
-                valid_coupons.append(Coupon(**coupon))
-    
-    return valid_coupons
+    # Customer-specific coupons that are still valid, straight from the cache
+    coupons = await coupon_engine.for_customer(current_user["email"])
+    return [Coupon(**coupon) for coupon in coupons]
+
+# ==================== DEMAND FORECAST (Admin only) ====================
+
+class DemandForecaster:
+    """Daily bottle rollup per zone, cached and refreshed incrementally.
+
+    The first request loads every non-cancelled order into the rollup (see
+    forecast.py). Later requests only fetch orders created after the
+    watermark, the newest created_at seen so far, re-reading the last
+    FORECAST_WATERMARK_OVERLAP_SECONDS so orders committed out of order are
+    not missed. Cancelled and deleted orders are subtracted through
+    `subtract`, and a full reload every FORECAST_REBUILD_SECONDS corrects
+    any drift. Forecasts are cached until the rollup or the date changes.
+    """
+
+    PROJECTION = {"_id": 0, "id": 1, "quantity": 1, "delivery_address": 1, "delivery_date": 1, "created_at": 1}
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Drop the cache and rebind the lock to the running event loop"""
+        self._rollup = None
+        self._watermark = None
+        self._recent = {}  # id -> created_at of orders counted within the overlap window
+        self._adjustments = []
+        self._loaded_at = None
+        self._forecasts = {}
+        self._lock = asyncio.Lock()
+
+    def _overlap_start(self, watermark: str) -> str:
+        return (datetime.fromisoformat(watermark) - timedelta(seconds=FORECAST_WATERMARK_OVERLAP_SECONDS)).isoformat()
+
+    def _is_counted(self, order: dict) -> bool:
+        if self._watermark is None or order["created_at"] > self._watermark:
+            return False
+        return order["created_at"] < self._overlap_start(self._watermark) or order["id"] in self._recent
+
+    def subtract(self, order: dict):
+        """Remove an order that stopped counting (cancelled or deleted)"""
+        if self._is_counted(order):
+            self._adjustments.append({
+                "quantity": -order["quantity"],
+                "delivery_address": order.get("delivery_address"),
+                "delivery_date": order.get("delivery_date")
+            })
 
-# ==================== INIT ADMIN ====================
+    async def refresh(self):
+        from forecast import daily_rollup, empty_rollup, merge_rollups
+        async with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > FORECAST_REBUILD_SECONDS:
+                self._rollup = empty_rollup()
+                self._watermark = None
+                self._recent = {}
+                self._adjustments = []
+                self._forecasts = {}
+                self._loaded_at = time.monotonic()
+
+            query = {"status": {"$ne": "cancelled"}}
+            if self._watermark is not None:
+                query["created_at"] = {"$gte": self._overlap_start(self._watermark)}
+            orders = await db.orders.find(query, self.PROJECTION).to_list(None)
+            new_orders = [order for order in orders if order["id"] not in self._recent]
+            adjustments, self._adjustments = self._adjustments, []
+            if not new_orders and not adjustments:
+                return
+
+            self._rollup = merge_rollups(self._rollup, daily_rollup(new_orders + adjustments))
+            self._forecasts = {}
+            if new_orders:
+                self._watermark = max([self._watermark or ""] + [order["created_at"] for order in new_orders])
+                overlap_start = self._overlap_start(self._watermark)
+                self._recent.update((order["id"], order["created_at"]) for order in new_orders)
+                self._recent = {
+                    order_id: created_at for order_id, created_at in self._recent.items()
+                    if created_at >= overlap_start
+                }
+
+    async def get(self, days: int, weeks: int) -> DemandForecast:
+        await self.refresh()
+        today = datetime.now(timezone.utc).date()
+        key = (today, days, weeks)
+        if key not in self._forecasts:
+            from forecast import forecast
+            zones = forecast(
+                self._rollup, today, days, weeks,
+                history_weeks=FORECAST_HISTORY_WEEKS, decay=FORECAST_WEEK_DECAY
+            )
+            self._forecasts[key] = DemandForecast(
+                generated_at=datetime.now(timezone.utc).isoformat(),
+                history_weeks=FORECAST_HISTORY_WEEKS,
+                zones=[ZoneForecast(**zone) for zone in zones[:-1]],
+                total=ZoneForecast(**zones[-1])
+            )
+        return self._forecasts[key]
+
+demand_forecaster = DemandForecaster()
+
+@on_order_status("cancelled")
+async def forecast_status_hook(order: dict, previous_status: str, actor: str):
+    demand_forecaster.subtract(order)
+
+@api_router.get("/forecast", response_model=DemandForecast)
+async def get_demand_forecast(
+    days: int = 7,
+    weeks: int = 4,
+    current_user: dict = Depends(get_current_admin)
+):
+    """Expected bottle demand per zone for the next `days` days and `weeks` weeks"""
+    if not 1 <= days <= FORECAST_MAX_DAYS or not 1 <= weeks <= FORECAST_MAX_WEEKS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El pronóstico admite de 1 a {FORECAST_MAX_DAYS} días y de 1 a {FORECAST_MAX_WEEKS} semanas"
+        )
+    return await demand_forecaster.get(days, weeks)
+
+# ==================== EVENT ROUTES (Admin only) ====================
+
+@api_router.get("/events", response_model=List[Event])
+async def get_events(
+    subject: Optional[str] = None,
+    type: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: dict = Depends(get_current_admin)
+):
+    query = {}
+    if subject:
+        query["subject"] = subject
+    if type:
+        query["type"] = type
+    events = await db.events.find(query, {"_id": 0}).sort("created_at", -1).to_list(limit)
+    return [Event(**event) for event in events]
+
+# ==================== STARTUP ====================
+
+background_tasks = []
+
+def connect_db():
+    global client, db
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+
+async def create_unique_index(collection, key: str):
+    """Create a unique index, or log the duplicate values that prevent it.
+
+    Databases written before the index existed can already hold duplicates
+    (two registrations with the same email, for instance). Rather than
+    refusing to start, the index is skipped and the conflicting values are
+    logged so they can be resolved (see "Índices únicos" in the README).
+    """
+    from pymongo.errors import OperationFailure
+    try:
+        await collection.create_index(key, unique=True)
+    except OperationFailure as e:
+        if e.code != 11000:
+            raise
+        duplicates = await collection.aggregate([
+            {"$group": {"_id": f"${key}", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$sort": {"_id": 1}},
+            {"$limit": 100}
+        ]).to_list(None)
+        logger.error(
+            f"Unique index on {collection.name}.{key} not created, duplicate values: "
+            + ", ".join(f"{duplicate['_id']!r} ({duplicate['count']})" for duplicate in duplicates)
+        )
+
+async def create_indexes():
+    await create_unique_index(db.users, "email")
+    await create_unique_index(db.coupons, "code")
+    await create_unique_index(db.orders, "id")
+    await create_unique_index(db.subscriptions, "id")
+    await db.subscriptions.create_index([("is_active", 1), ("next_run_at", 1)])
+    await create_unique_index(db.revoked_tokens, "jti")
+    await db.revoked_tokens.create_index("expires_at", expireAfterSeconds=0)
+    await db.events.create_index([("subject", 1), ("created_at", -1)])
+    await db.events.create_index("created_at")
+    await create_unique_index(db.customer_summaries, "customer_email")
+    await db.orders.create_index([("customer_email", 1), ("created_at", -1)])
+    await db.orders.create_index("created_at")
 
-@app.on_event("startup")
 async def create_admin():
     admin = await db.users.find_one({"email": "admin@acqua.com"})
     if not admin:
@@ -542,16 +2028,35 @@ async def create_admin():
         await db.users.insert_one(admin_data)
         print("Admin user created: admin@acqua.com / admin123")
 
-# Include router
-app.include_router(api_router)
+def start_background_tasks():
+    if os.environ.get('SUBSCRIPTION_SCHEDULER_ENABLED', 'true').lower() == 'true':
+        background_tasks.append(asyncio.create_task(run_subscription_scheduler()))
+    background_tasks.append(asyncio.create_task(run_revocation_sync()))
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+async def stop_background_tasks():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client
+    if db is None:
+        connect_db()
+    coupon_engine.reset()
+    demand_forecaster.reset()
+    await create_indexes()
+    await create_admin()
+    await sync_revoked_tokens()
+    event_outbox.start()
+    start_background_tasks()
+    yield
+    await stop_background_tasks()
+    await event_outbox.close()
+    if client is not None:
+        client.close()
+        client = None
 
 logging.basicConfig(
     level=logging.INFO,
@@ -559,6 +2064,30 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+# ==================== APP FACTORY ====================
+
+def create_app(database=None) -> FastAPI:
+    """Build the ASGI app.
+
+    The Mongo client is created in the lifespan, not at import time. Pass
+    `database` to serve an already-open database (tests) instead of
+    connecting to MONGO_URL. Also usable as `uvicorn --factory server:create_app`.
+    """
+    global db
+    if database is not None:
+        db = database
+
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(api_router)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    if COMPRESSION_ENABLED:
+        app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+    return app
+
+app = create_app()
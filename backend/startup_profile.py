@@ -0,0 +1,85 @@
+"""Import-time breakdown for the backend.
+
+Runs `import server` in a fresh interpreter with `-X importtime` and prints
+the wall-clock import time plus the slowest modules imported by server.py,
+so regressions in cold-start time can be traced to a specific dependency.
+
+Usage:
+    python startup_profile.py [--top 15]
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+
+# Cold-start budget for `import server` (seconds), enforced by tests/test_startup.py
+STARTUP_BUDGET_SECONDS = float(os.environ.get('STARTUP_BUDGET_SECONDS', '1.5'))
+
+# Modules that must only be imported on first use, never at startup
+DEFERRED_MODULES = ("motor", "pymongo", "passlib", "numpy", "pandas")
+
+MEASURE_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import server
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(",".join(sorted({name.split(".")[0] for name in sys.modules})))
+"""
+
+
+def measure_import():
+    """Return (seconds, top-level modules loaded) for `import server`"""
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE_SCRIPT],
+        cwd=ROOT_DIR, capture_output=True, text=True, check=True
+    )
+    elapsed, modules = result.stdout.strip().splitlines()[-2:]
+    return float(elapsed), set(modules.split(","))
+
+
+def import_breakdown():
+    """Return [(cumulative_us, self_us, module)] for modules imported by server.py"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=ROOT_DIR, capture_output=True, text=True, check=True
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((depth, int(cumulative_us), int(self_us), name.strip()))
+
+    # importtime prints children before their parent, so everything between
+    # the previous top-level entry and `server` was imported by server.py
+    server_index = next(i for i, entry in enumerate(entries) if entry[0] == 0 and entry[3] == "server")
+    start = max((i for i in range(server_index) if entries[i][0] == 0), default=-1) + 1
+    children = [entry for entry in entries[start:server_index] if entry[0] == 1]
+    server_entry = entries[server_index]
+    rows = [(cumulative, self_time, name) for _, cumulative, self_time, name in children]
+    rows.append((server_entry[2], server_entry[2], "server (module body)"))
+    return sorted(rows, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=15, help="number of modules to list")
+    args = parser.parse_args()
+
+    elapsed, modules = measure_import()
+    print(f"import server: {elapsed * 1000:.0f} ms (budget {STARTUP_BUDGET_SECONDS * 1000:.0f} ms)")
+    loaded = [name for name in DEFERRED_MODULES if name in modules]
+    print(f"deferred modules loaded at startup: {', '.join(loaded) or 'none'}")
+    print()
+    print(f"{'cumulative ms':>14}  {'self ms':>8}  module")
+    for cumulative, self_time, name in import_breakdown()[:args.top]:
+        print(f"{cumulative / 1000:>14.1f}  {self_time / 1000:>8.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
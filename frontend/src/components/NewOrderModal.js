@@ -37,7 +37,7 @@ const NewOrderModal = ({ onClose, onSuccess }) => {
     try {
       const response = await axios.post(
         `${API_URL}/coupons/validate`,
-        { code: formData.coupon_code },
+        { code: formData.coupon_code, quantity: formData.quantity },
         { headers: { Authorization: `Bearer ${token}` } }
       );
       
@@ -5,11 +5,65 @@ const AuthContext = createContext();
 
 const API_URL = process.env.REACT_APP_BACKEND_URL + "/api";
 
+// Access tokens are short-lived; one refresh request is shared by every call
+// that fails with 401 while it is in flight.
+let refreshPromise = null;
+
+const refreshSession = () => {
+  if (!refreshPromise) {
+    const refreshToken = localStorage.getItem("refresh_token");
+    refreshPromise = (refreshToken
+      ? axios.post(`${API_URL}/auth/refresh`, { refresh_token: refreshToken })
+      : Promise.reject(new Error("No refresh token"))
+    )
+      .then((response) => {
+        localStorage.setItem("token", response.data.access_token);
+        localStorage.setItem("refresh_token", response.data.refresh_token);
+        return response.data.access_token;
+      })
+      .finally(() => {
+        refreshPromise = null;
+      });
+  }
+  return refreshPromise;
+};
+
 export const AuthProvider = ({ children }) => {
   const [user, setUser] = useState(null);
   const [token, setToken] = useState(localStorage.getItem("token"));
   const [loading, setLoading] = useState(true);
 
+  useEffect(() => {
+    const interceptor = axios.interceptors.response.use(
+      (response) => response,
+      async (error) => {
+        const request = error.config;
+        if (
+          error.response?.status !== 401 ||
+          !request ||
+          request._retried ||
+          request.url?.includes("/auth/")
+        ) {
+          return Promise.reject(error);
+        }
+        request._retried = true;
+        try {
+          const newToken = await refreshSession();
+          setToken(newToken);
+          request.headers.Authorization = `Bearer ${newToken}`;
+          return axios(request);
+        } catch (refreshError) {
+          localStorage.removeItem("token");
+          localStorage.removeItem("refresh_token");
+          setToken(null);
+          setUser(null);
+          return Promise.reject(error);
+        }
+      }
+    );
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
+
   useEffect(() => {
     const verifyToken = async () => {
       if (token) {
@@ -19,9 +73,15 @@ export const AuthProvider = ({ children }) => {
           });
           setUser(response.data);
         } catch (error) {
-          console.error("Token verification failed:", error);
-          localStorage.removeItem("token");
-          setToken(null);
+          try {
+            setToken(await refreshSession());
+            return;
+          } catch (refreshError) {
+            console.error("Token verification failed:", error);
+            localStorage.removeItem("token");
+            localStorage.removeItem("refresh_token");
+            setToken(null);
+          }
         }
       }
       setLoading(false);
@@ -35,8 +95,9 @@ export const AuthProvider = ({ children }) => {
       email,
       password,
     });
-    const { access_token, user: userData } = response.data;
+    const { access_token, refresh_token, user: userData } = response.data;
     localStorage.setItem("token", access_token);
+    localStorage.setItem("refresh_token", refresh_token);
     setToken(access_token);
     setUser(userData);
     return userData;
@@ -44,15 +105,26 @@ export const AuthProvider = ({ children }) => {
 
   const register = async (data) => {
     const response = await axios.post(`${API_URL}/auth/register`, data);
-    const { access_token, user: userData } = response.data;
+    const { access_token, refresh_token, user: userData } = response.data;
     localStorage.setItem("token", access_token);
+    localStorage.setItem("refresh_token", refresh_token);
     setToken(access_token);
     setUser(userData);
     return userData;
   };
 
   const logout = () => {
+    if (token) {
+      axios
+        .post(
+          `${API_URL}/auth/logout`,
+          { refresh_token: localStorage.getItem("refresh_token") },
+          { headers: { Authorization: `Bearer ${token}` } }
+        )
+        .catch(() => {});
+    }
     localStorage.removeItem("token");
+    localStorage.removeItem("refresh_token");
     setToken(null);
     setUser(null);
   };
@@ -27,6 +27,14 @@ import CouponsManagement from "@/components/CouponsManagement";
 
 const API_URL = process.env.REACT_APP_BACKEND_URL + "/api";
 
+// Status changes accepted by the API; delivered and cancelled are final
+const STATUS_TRANSITIONS = {
+  pending: ["in_transit", "cancelled"],
+  in_transit: ["delivered", "cancelled"],
+  delivered: [],
+  cancelled: [],
+};
+
 const AdminDashboard = () => {
   const { user, logout, token } = useAuth();
   const navigate = useNavigate();
@@ -226,7 +234,7 @@ const OrdersTab = ({ token }) => {
       toast.success("Estado actualizado");
       fetchOrders();
     } catch (error) {
-      toast.error("Error al actualizar estado");
+      toast.error(error.response?.data?.detail || "Error al actualizar estado");
     }
   };
 
@@ -288,6 +296,7 @@ const OrdersTab = ({ token }) => {
                   <Select
                     value={order.status}
                     onValueChange={(value) => handleStatusChange(order.id, value)}
+                    disabled={STATUS_TRANSITIONS[order.status]?.length === 0}
                   >
                     <SelectTrigger
                       data-testid={`status-select-${order.id}`}
@@ -296,10 +305,10 @@ const OrdersTab = ({ token }) => {
                       <SelectValue />
                     </SelectTrigger>
                     <SelectContent>
-                      <SelectItem value="pending">Pendiente</SelectItem>
-                      <SelectItem value="in_transit">En Camino</SelectItem>
-                      <SelectItem value="delivered">Entregado</SelectItem>
-                      <SelectItem value="cancelled">Cancelado</SelectItem>
+                      <SelectItem value="pending" disabled={!STATUS_TRANSITIONS[order.status]?.includes("pending")}>Pendiente</SelectItem>
+                      <SelectItem value="in_transit" disabled={!STATUS_TRANSITIONS[order.status]?.includes("in_transit")}>En Camino</SelectItem>
+                      <SelectItem value="delivered" disabled={!STATUS_TRANSITIONS[order.status]?.includes("delivered")}>Entregado</SelectItem>
+                      <SelectItem value="cancelled" disabled={!STATUS_TRANSITIONS[order.status]?.includes("cancelled")}>Cancelado</SelectItem>
                     </SelectContent>
                   </Select>
                 </div>
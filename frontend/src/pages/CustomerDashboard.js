@@ -20,20 +20,13 @@ const CustomerDashboard = () => {
 
   const fetchData = async () => {
     try {
-      const [ordersRes, statsRes, couponsRes] = await Promise.all([
-        axios.get(`${API_URL}/orders`, {
-          headers: { Authorization: `Bearer ${token}` },
-        }),
-        axios.get(`${API_URL}/stats`, {
-          headers: { Authorization: `Bearer ${token}` },
-        }),
-        axios.get(`${API_URL}/coupons/my-coupons`, {
-          headers: { Authorization: `Bearer ${token}` },
-        }),
-      ]);
-      setOrders(ordersRes.data);
-      setStats(statsRes.data);
-      setCoupons(couponsRes.data);
+      const response = await axios.get(`${API_URL}/me/dashboard`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      const { recent_orders, coupons: myCoupons, ...summary } = response.data;
+      setOrders(recent_orders);
+      setStats(summary);
+      setCoupons(myCoupons);
     } catch (error) {
       toast.error("Error al cargar los datos");
     } finally {
@@ -170,7 +163,7 @@ const CustomerDashboard = () => {
 
         {/* Orders List */}
         <div className="glass-card rounded-2xl p-6 shadow-sm">
-          <h2 className="text-2xl font-semibold text-slate-900 mb-6">Mis Pedidos</h2>
+          <h2 className="text-2xl font-semibold text-slate-900 mb-6">Mis Pedidos Recientes</h2>
           
           {orders.length === 0 ? (
             <div className="text-center py-12">
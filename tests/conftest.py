@@ -0,0 +1,125 @@
+"""Fixtures for the async API tests.
+
+The app runs in-process through httpx's ASGI transport against
+`tests/fake_mongo.py`, or against a throwaway database on a real server
+when TEST_MONGO_URL is set (e.g. TEST_MONGO_URL=mongodb://localhost:27017);
+that database is dropped afterwards.
+"""
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+import pytest_asyncio
+from pymongo import monitoring
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("SUBSCRIPTION_SCHEDULER_ENABLED", "false")
+
+import server  # noqa: E402
+from tests.fake_mongo import FakeDatabase  # noqa: E402
+
+ADMIN = {"email": "admin@acqua.com", "password": "admin123"}
+
+
+class CommandLog(monitoring.CommandListener):
+    """Collection names of the database commands sent by the app, in order"""
+
+    def __init__(self):
+        self.collections = []
+
+    def reset(self):
+        self.collections.clear()
+
+    def __len__(self):
+        return len(self.collections)
+
+    def started(self, event):
+        # Collection commands name their collection as the first value;
+        # handshakes, getMore and endSessions are not counted
+        target = event.command.get(event.command_name)
+        if isinstance(target, str):
+            self.collections.append(target)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fast_password_hashing(monkeypatch):
+    # bcrypt at the production cost factor makes every registration ~0.3s
+    from passlib.context import CryptContext
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4)
+    monkeypatch.setattr(server, "get_pwd_context", lambda: context)
+
+
+@pytest.fixture
+def command_log():
+    return CommandLog()
+
+
+@pytest_asyncio.fixture
+async def database(command_log):
+    mongo_url = os.environ.get("TEST_MONGO_URL")
+    if not mongo_url:
+        yield FakeDatabase(commands=command_log.collections)
+        return
+
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(mongo_url, event_listeners=[command_log])
+    name = f"acqua_test_{uuid.uuid4().hex[:12]}"
+    yield client[name]
+    await client.drop_database(name)
+    client.close()
+
+
+@pytest_asyncio.fixture
+async def client(database, monkeypatch):
+    monkeypatch.setattr(server, "db", None)
+    app = server.create_app(database=database)
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            yield http
+
+
+async def auth_headers(client, email, password):
+    response = await client.post("/api/auth/login", json={"email": email, "password": password})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest_asyncio.fixture
+async def admin(client):
+    return await auth_headers(client, ADMIN["email"], ADMIN["password"])
+
+
+@pytest.fixture
+def register(client):
+    """Register a customer and return its auth headers"""
+    async def register_customer(email, name="Cliente Prueba"):
+        response = await client.post("/api/auth/register", json={
+            "email": email,
+            "password": "secreto123",
+            "name": name,
+            "phone": "8112345678",
+            "address": "Av. Constitución 100, Centro, CP 64000"
+        })
+        assert response.status_code == 200, response.text
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return register_customer
+
+
+def order_payload(quantity=1, **extra):
+    return {
+        "quantity": quantity,
+        "delivery_address": "Av. Constitución 100, Centro, CP 64000",
+        "delivery_date": "2026-11-02",
+        "delivery_time": "10:00",
+        **extra
+    }
@@ -0,0 +1,696 @@
+"""In-memory stand-in for the subset of Motor used by the backend.
+
+Each operation yields to the event loop once before touching data, so
+concurrent requests interleave the way they would against a real server,
+while the operation itself stays atomic. Every operation appends the
+collection name to ``FakeDatabase.commands`` so tests can count round trips.
+"""
+import asyncio
+import copy
+import itertools
+import re
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_ids = itertools.count(1)
+_MISSING = object()
+
+
+# ==================== PATH HELPERS ====================
+
+def _get(doc, path):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list) and part.isdigit():
+            index = int(part)
+            value = value[index] if index < len(value) else _MISSING
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _set(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset(doc, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+# ==================== QUERY MATCHING ====================
+
+def _compare(op, value, arg):
+    if value is _MISSING or value is None:
+        return False
+    try:
+        if op == "$gt":
+            return value > arg
+        if op == "$gte":
+            return value >= arg
+        if op == "$lt":
+            return value < arg
+        return value <= arg
+    except TypeError:
+        return False
+
+
+def _match_operator(value, op, arg):
+    candidates = value if isinstance(value, list) else [value]
+    if op == "$eq":
+        return _match_value(value, arg)
+    if op == "$ne":
+        return not _match_value(value, arg)
+    if op == "$in":
+        return any(_match_value(value, a) for a in arg)
+    if op == "$nin":
+        return not any(_match_value(value, a) for a in arg)
+    if op == "$exists":
+        return (value is not _MISSING) == bool(arg)
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        return any(_compare(op, v, arg) for v in candidates)
+    if op == "$regex":
+        return isinstance(value, str) and re.search(arg, value) is not None
+    raise NotImplementedError(f"Unsupported query operator {op}")
+
+
+def _match_value(value, expected):
+    if isinstance(expected, dict) and expected and all(k.startswith("$") for k in expected):
+        return all(_match_operator(value, op, arg) for op, arg in expected.items())
+    if value is _MISSING:
+        return expected is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def matches(doc, query):
+    for key, expected in (query or {}).items():
+        if key == "$and":
+            if not all(matches(doc, q) for q in expected):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, q) for q in expected):
+                return False
+        elif not _match_value(_get(doc, key), expected):
+            return False
+    return True
+
+
+# ==================== PROJECTION / SORT ====================
+
+def project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    include = {k for k, v in projection.items() if v and k != "_id"}
+    if include:
+        result = {}
+        for path in include:
+            value = _get(doc, path)
+            if value is not _MISSING:
+                _set(result, path, copy.deepcopy(value))
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    result = copy.deepcopy(doc)
+    for path, flag in projection.items():
+        if not flag:
+            _unset(result, path)
+    return result
+
+
+def _sort_key(value):
+    if value is _MISSING or value is None:
+        return (0, "")
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    return (3, str(value))
+
+
+def _sorted(docs, spec):
+    for key, direction in reversed(spec):
+        docs = sorted(docs, key=lambda d: _sort_key(_get(d, key)), reverse=direction < 0)
+    return docs
+
+
+def _sort_spec(key_or_list, direction=None):
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    return list(key_or_list)
+
+
+# ==================== UPDATES ====================
+
+def _array_filter_match(element, ident, filters):
+    for flt in filters or []:
+        conditions = {k.split(".", 1)[1] if "." in k else "": v for k, v in flt.items()
+                      if k.split(".", 1)[0] == ident}
+        if not conditions:
+            continue
+        for path, expected in conditions.items():
+            value = element if path == "" else _get(element, path)
+            if not _match_value(value, expected):
+                return False
+    return True
+
+
+def _resolve_paths(doc, path, array_filters):
+    """Expand ``$[ident]`` placeholders into concrete dotted paths."""
+    match = re.search(r"\$\[(\w*)\]", path)
+    if not match:
+        return [path]
+    prefix = path[:match.start()].rstrip(".")
+    suffix = path[match.end():].lstrip(".")
+    array = _get(doc, prefix)
+    if not isinstance(array, list):
+        return []
+    paths = []
+    for index, element in enumerate(array):
+        if match.group(1) and not _array_filter_match(element, match.group(1), array_filters):
+            continue
+        concrete = f"{prefix}.{index}" + (f".{suffix}" if suffix else "")
+        paths.extend(_resolve_paths(doc, concrete, array_filters))
+    return paths
+
+
+def _set_path(doc, path, value):
+    parts = path.split(".")
+    target = doc
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            target = target[int(part)]
+        else:
+            target = target.setdefault(part, {})
+    if isinstance(target, list):
+        target[int(parts[-1])] = value
+    else:
+        target[parts[-1]] = value
+
+
+def apply_update(doc, update, array_filters=None, inserting=False):
+    for op, fields in update.items():
+        for raw_path, arg in fields.items():
+            for path in _resolve_paths(doc, raw_path, array_filters):
+                current = _get(doc, path)
+                if op == "$set":
+                    _set_path(doc, path, copy.deepcopy(arg))
+                elif op == "$setOnInsert":
+                    if inserting:
+                        _set_path(doc, path, copy.deepcopy(arg))
+                elif op == "$unset":
+                    _unset(doc, path)
+                elif op == "$inc":
+                    _set_path(doc, path, (0 if current is _MISSING else current) + arg)
+                elif op == "$max":
+                    if current is _MISSING or arg > current:
+                        _set_path(doc, path, arg)
+                elif op == "$min":
+                    if current is _MISSING or arg < current:
+                        _set_path(doc, path, arg)
+                elif op in ("$push", "$addToSet"):
+                    array = [] if current is _MISSING else list(current)
+                    if isinstance(arg, dict) and "$each" in arg:
+                        items = copy.deepcopy(arg["$each"])
+                    else:
+                        items = [copy.deepcopy(arg)]
+                    if op == "$addToSet":
+                        items = [i for i in items if i not in array]
+                    position = arg.get("$position") if isinstance(arg, dict) else None
+                    if position is None:
+                        array.extend(items)
+                    else:
+                        array[position:position] = items
+                    if isinstance(arg, dict) and "$slice" in arg:
+                        limit = arg["$slice"]
+                        array = array[limit:] if limit < 0 else array[:limit]
+                    _set_path(doc, path, array)
+                elif op == "$pull":
+                    if current is not _MISSING:
+                        _set_path(doc, path, [
+                            item for item in current
+                            if not (matches(item, arg) if isinstance(arg, dict) and isinstance(item, dict)
+                                    else _match_value(item, arg))
+                        ])
+                else:
+                    raise NotImplementedError(f"Unsupported update operator {op}")
+
+
+def _upsert_seed(query):
+    seed = {}
+    for key, value in (query or {}).items():
+        if key.startswith("$"):
+            continue
+        if isinstance(value, dict) and any(k.startswith("$") for k in value):
+            if "$eq" in value:
+                _set(seed, key, value["$eq"])
+            continue
+        _set(seed, key, copy.deepcopy(value))
+    return seed
+
+
+# ==================== RESULTS ====================
+
+class InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class InsertManyResult:
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+
+
+class UpdateResult:
+    def __init__(self, matched, modified, upserted_id=None):
+        self.matched_count = matched
+        self.modified_count = modified
+        self.upserted_id = upserted_id
+
+
+class DeleteResult:
+    def __init__(self, deleted):
+        self.deleted_count = deleted
+
+
+class BulkWriteResult:
+    def __init__(self):
+        self.inserted_count = 0
+        self.matched_count = 0
+        self.modified_count = 0
+        self.deleted_count = 0
+        self.upserted_count = 0
+
+
+# ==================== CURSOR ====================
+
+class FakeCursor:
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+        self._buffer = None
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def _materialise(self):
+        docs = [d for d in self._collection._docs if matches(d, self._query)]
+        if self._sort:
+            docs = _sorted(docs, self._sort)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [project(d, self._projection) for d in docs]
+
+    async def to_list(self, length=None):
+        await self._collection._round_trip()
+        docs = self._materialise()
+        return docs if length is None else docs[:length]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._buffer is None:
+            await self._collection._round_trip()
+            self._buffer = self._materialise()
+        if not self._buffer:
+            raise StopAsyncIteration
+        return self._buffer.pop(0)
+
+
+class FakeAggregateCursor:
+    def __init__(self, collection, pipeline):
+        self._collection = collection
+        self._pipeline = pipeline
+
+    async def to_list(self, length=None):
+        await self._collection._round_trip()
+        docs = [copy.deepcopy(d) for d in self._collection._docs]
+        for stage in self._pipeline:
+            docs = _run_stage(docs, stage)
+        return docs if length is None else docs[:length]
+
+    def __aiter__(self):
+        self._iter = None
+        return self
+
+    async def __anext__(self):
+        if self._iter is None:
+            self._iter = iter(await self.to_list(None))
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+def _eval_expression(doc, expr):
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = _get(doc, expr[1:])
+        return None if value is _MISSING else value
+    if isinstance(expr, dict):
+        if "$cond" in expr:
+            cond, then, other = expr["$cond"]
+            return _eval_expression(doc, then if _eval_expression(doc, cond) else other)
+        if "$eq" in expr:
+            left, right = expr["$eq"]
+            return _eval_expression(doc, left) == _eval_expression(doc, right)
+        if "$substrBytes" in expr:
+            value, start, length = expr["$substrBytes"]
+            return (_eval_expression(doc, value) or "")[start:start + length]
+        return {k: _eval_expression(doc, v) for k, v in expr.items()}
+    return expr
+
+
+def _run_stage(docs, stage):
+    (name, spec), = stage.items()
+    if name == "$match":
+        return [d for d in docs if matches(d, spec)]
+    if name == "$sort":
+        return _sorted(docs, list(spec.items()))
+    if name == "$limit":
+        return docs[:spec]
+    if name == "$project":
+        return [{k: (_eval_expression(d, v) if v not in (0, 1, True, False) else _get(d, k))
+                 for k, v in spec.items() if v not in (0, False)} for d in docs]
+    if name == "$group":
+        groups = {}
+        for doc in docs:
+            key = _eval_expression(doc, spec["_id"])
+            hashable = repr(key)
+            group = groups.setdefault(hashable, {"_id": key})
+            for field, accumulator in spec.items():
+                if field == "_id":
+                    continue
+                (acc, arg), = accumulator.items()
+                value = _eval_expression(doc, arg)
+                if acc == "$sum":
+                    group[field] = group.get(field, 0) + (value or 0)
+                elif acc == "$max":
+                    if field not in group or (value is not None and value > group[field]):
+                        group[field] = value
+                elif acc == "$min":
+                    if field not in group or (value is not None and value < group[field]):
+                        group[field] = value
+                elif acc == "$first":
+                    group.setdefault(field, value)
+                else:
+                    raise NotImplementedError(f"Unsupported accumulator {acc}")
+        return list(groups.values())
+    raise NotImplementedError(f"Unsupported aggregation stage {name}")
+
+
+# ==================== COLLECTION / DATABASE ====================
+
+class FakeCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._docs = []
+        self._unique = {}
+
+    async def _round_trip(self):
+        self.database.commands.append(self.name)
+        await asyncio.sleep(0)
+
+    def _index_key(self, doc, keys):
+        values = tuple(_get(doc, k) for k in keys)
+        if all(v is _MISSING for v in values):
+            return None
+        return repr(tuple(None if v is _MISSING else v for v in values))
+
+    def _candidates(self, filter):
+        """Documents that may match ``filter``, found through a unique index
+        when the filter pins every key of one, like the server would."""
+        for keys, entries in self._unique.items():
+            values = [filter.get(k) for k in keys]
+            if all(v is not None and not isinstance(v, (dict, list)) for v in values):
+                doc = entries.get(repr(tuple(values)))
+                return [doc] if doc is not None else []
+        return self._docs
+
+    def _index(self, doc, previous=None):
+        """Register ``doc`` in the unique indexes, replacing ``previous``."""
+        claimed = []
+        for keys, entries in self._unique.items():
+            key = self._index_key(doc, keys)
+            owner = entries.get(key) if key is not None else None
+            if owner is not None and owner is not doc:
+                for done_keys, done_key in claimed:
+                    self._unique[done_keys].pop(done_key, None)
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.name} index: {list(keys)}",
+                    11000,
+                )
+            if key is not None:
+                entries[key] = doc
+                claimed.append((keys, key))
+        if previous is not None:
+            for keys, entries in self._unique.items():
+                old_key = self._index_key(previous, keys)
+                if old_key is not None and entries.get(old_key) is doc and old_key != self._index_key(doc, keys):
+                    del entries[old_key]
+
+    def _unindex(self, doc):
+        for keys, entries in self._unique.items():
+            key = self._index_key(doc, keys)
+            if key is not None and entries.get(key) is doc:
+                del entries[key]
+
+    def _remove(self, doc):
+        self._docs.remove(doc)
+        self._unindex(doc)
+
+    def _insert(self, doc):
+        doc.setdefault("_id", f"oid{next(_ids)}")
+        stored = copy.deepcopy(doc)
+        self._index(stored)
+        self._docs.append(stored)
+        return doc["_id"]
+
+    async def create_index(self, keys, unique=False, **kwargs):
+        await self._round_trip()
+        spec = _sort_spec(keys)
+        if unique:
+            keys = tuple(k for k, _ in spec)
+            if keys not in self._unique:
+                entries = {}
+                for doc in self._docs:
+                    key = self._index_key(doc, keys)
+                    if key in entries:
+                        raise DuplicateKeyError(
+                            f"E11000 duplicate key error collection: {self.name} index: {list(keys)}",
+                            11000,
+                        )
+                    if key is not None:
+                        entries[key] = doc
+                self._unique[keys] = entries
+        return "_".join(f"{k}_{d}" for k, d in spec)
+
+    def find(self, filter=None, projection=None, **kwargs):
+        cursor = FakeCursor(self, filter or {}, projection)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        if kwargs.get("limit"):
+            cursor.limit(kwargs["limit"])
+        return cursor
+
+    async def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        await self._round_trip()
+        docs = [d for d in self._candidates(filter or {}) if matches(d, filter or {})]
+        if sort:
+            docs = _sorted(docs, _sort_spec(sort))
+        return project(docs[0], projection) if docs else None
+
+    async def count_documents(self, filter, **kwargs):
+        await self._round_trip()
+        return sum(1 for d in self._docs if matches(d, filter))
+
+    async def distinct(self, key, filter=None):
+        await self._round_trip()
+        values = []
+        for doc in self._docs:
+            if matches(doc, filter or {}):
+                value = _get(doc, key)
+                if value is not _MISSING and value not in values:
+                    values.append(value)
+        return values
+
+    def aggregate(self, pipeline, **kwargs):
+        return FakeAggregateCursor(self, pipeline)
+
+    async def insert_one(self, document, **kwargs):
+        await self._round_trip()
+        return InsertOneResult(self._insert(document))
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        await self._round_trip()
+        inserted, errors = [], []
+        for index, doc in enumerate(documents):
+            try:
+                inserted.append(self._insert(doc))
+            except DuplicateKeyError as exc:
+                errors.append({"index": index, "code": 11000, "errmsg": str(exc)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted)})
+        return InsertManyResult(inserted)
+
+    def _update(self, filter, update, upsert, array_filters, many):
+        matched = modified = 0
+        upserted_id = None
+        for doc in [d for d in self._candidates(filter) if matches(d, filter)]:
+            before = copy.deepcopy(doc)
+            apply_update(doc, update, array_filters)
+            try:
+                self._index(doc, previous=before)
+            except DuplicateKeyError:
+                doc.clear()
+                doc.update(before)
+                raise
+            matched += 1
+            modified += int(doc != before)
+            if not many:
+                break
+        if not matched and upsert:
+            doc = _upsert_seed(filter)
+            apply_update(doc, update, array_filters, inserting=True)
+            upserted_id = self._insert(doc)
+        return UpdateResult(matched, modified, upserted_id)
+
+    async def update_one(self, filter, update, upsert=False, array_filters=None, **kwargs):
+        await self._round_trip()
+        return self._update(filter, update, upsert, array_filters, many=False)
+
+    async def update_many(self, filter, update, upsert=False, array_filters=None, **kwargs):
+        await self._round_trip()
+        return self._update(filter, update, upsert, array_filters, many=True)
+
+    async def find_one_and_update(self, filter, update, projection=None, sort=None,
+                                  upsert=False, return_document=ReturnDocument.BEFORE,
+                                  array_filters=None, **kwargs):
+        await self._round_trip()
+        docs = [d for d in self._candidates(filter) if matches(d, filter)]
+        if sort:
+            docs = _sorted(docs, _sort_spec(sort))
+        if not docs:
+            if not upsert:
+                return None
+            doc = _upsert_seed(filter)
+            apply_update(doc, update, array_filters, inserting=True)
+            self._insert(doc)
+            stored = self._docs[-1]
+            return project(stored, projection) if return_document == ReturnDocument.AFTER else None
+        doc = docs[0]
+        before = copy.deepcopy(doc)
+        apply_update(doc, update, array_filters)
+        try:
+            self._index(doc, previous=before)
+        except DuplicateKeyError:
+            doc.clear()
+            doc.update(before)
+            raise
+        return project(doc if return_document == ReturnDocument.AFTER else before, projection)
+
+    async def find_one_and_delete(self, filter, projection=None, **kwargs):
+        await self._round_trip()
+        for doc in self._docs:
+            if matches(doc, filter):
+                self._remove(doc)
+                return project(doc, projection)
+        return None
+
+    async def delete_one(self, filter, **kwargs):
+        await self._round_trip()
+        for doc in self._docs:
+            if matches(doc, filter):
+                self._remove(doc)
+                return DeleteResult(1)
+        return DeleteResult(0)
+
+    async def delete_many(self, filter, **kwargs):
+        await self._round_trip()
+        doomed = [d for d in self._docs if matches(d, filter)]
+        for doc in doomed:
+            self._remove(doc)
+        return DeleteResult(len(doomed))
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        await self._round_trip()
+        result = BulkWriteResult()
+        errors = []
+        for index, request in enumerate(requests):
+            kind = type(request).__name__
+            doc = request._doc
+            try:
+                if kind == "InsertOne":
+                    self._insert(doc)
+                    result.inserted_count += 1
+                elif kind in ("UpdateOne", "UpdateMany"):
+                    outcome = self._update(request._filter, doc, request._upsert,
+                                           request._array_filters, many=kind == "UpdateMany")
+                    result.matched_count += outcome.matched_count
+                    result.modified_count += outcome.modified_count
+                    result.upserted_count += int(outcome.upserted_id is not None)
+                elif kind in ("DeleteOne", "DeleteMany"):
+                    for stored in [d for d in self._docs if matches(d, request._filter)]:
+                        self._remove(stored)
+                        result.deleted_count += 1
+                        if kind == "DeleteOne":
+                            break
+                else:
+                    raise NotImplementedError(f"Unsupported bulk request {kind}")
+            except DuplicateKeyError as exc:
+                errors.append({"index": index, "code": 11000, "errmsg": str(exc)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": result.inserted_count})
+        return result
+
+
+class FakeDatabase:
+    def __init__(self, name="test_database", commands=None):
+        self.name = name
+        self._collections = {}
+        self.commands = [] if commands is None else commands
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self, name)
+        return self._collections[name]
@@ -0,0 +1,115 @@
+import base64
+import hashlib
+import hmac
+import json
+
+import pytest
+
+import server
+from auth_tokens import DEFAULT_KID, TokenError, TokenSigner, parse_keys
+
+pytestmark = pytest.mark.asyncio
+
+ADMIN_LOGIN = {"email": "admin@acqua.com", "password": "admin123"}
+
+
+def segment(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).rstrip(b"=").decode()
+
+
+def signed(header, payload, secret=b"secreto") -> str:
+    signing_input = f"{segment(header)}.{segment(payload)}"
+    signature = hmac.new(secret, signing_input.encode(), hashlib.sha256).digest()
+    return signing_input + "." + base64.urlsafe_b64encode(signature).rstrip(b"=").decode()
+
+
+@pytest.mark.parametrize("token", [
+    "W10.e30.c2ln",  # header is []
+    segment({"alg": "HS256", "kid": ["default"]}) + ".e30.c2ln",
+    segment({"alg": "HS256", "kid": {"a": 1}}) + ".e30.c2ln",
+    signed({"alg": "HS256", "kid": "default"}, [1, 2]),
+    signed({"alg": "HS256", "kid": "default"}, {"exp": 4102444800, "jti": ["x"]}),
+    "a.b",
+    "%%%.%%%.%%%",
+])
+async def test_malformed_tokens_raise_token_error(token):
+    signer = TokenSigner({"default": b"secreto"})
+
+    with pytest.raises(TokenError):
+        signer.decode(token)
+
+
+async def test_malformed_bearer_token_is_401(client):
+    for token in ("W10.e30.c2ln", segment({"alg": "HS256", "kid": ["default"]}) + ".e30.c2ln"):
+        response = await client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 401
+
+
+async def test_refresh_tokens_are_single_use(client):
+    tokens = (await client.post("/api/auth/login", json=ADMIN_LOGIN)).json()
+
+    rotated = await client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    replayed = await client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    access_as_refresh = await client.post("/api/auth/refresh", json={"refresh_token": tokens["access_token"]})
+
+    assert rotated.status_code == 200
+    assert rotated.json()["refresh_token"] != tokens["refresh_token"]
+    assert replayed.status_code == 401
+    assert access_as_refresh.status_code == 401
+    new_access = {"Authorization": f"Bearer {rotated.json()['access_token']}"}
+    assert (await client.get("/api/auth/me", headers=new_access)).status_code == 200
+
+
+async def test_logout_revokes_access_and_refresh_tokens(client):
+    tokens = (await client.post("/api/auth/login", json=ADMIN_LOGIN)).json()
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    response = await client.post("/api/auth/logout", headers=headers, json={"refresh_token": tokens["refresh_token"]})
+
+    assert response.status_code == 200
+    assert (await client.get("/api/auth/me", headers=headers)).status_code == 401
+    assert (await client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})).status_code == 401
+    # Other workers pick the revocation up from the collection
+    server.revoked_tokens.replace([])
+    await server.sync_revoked_tokens()
+    assert (await client.get("/api/auth/me", headers=headers)).status_code == 401
+
+
+async def test_tokens_survive_key_rotation(client, monkeypatch):
+    old_keys = {"default": b"secreto", "2026-09": b"clave-anterior"}
+    monkeypatch.setattr(server, "token_signer", TokenSigner(old_keys, active_kid="2026-09"))
+    old_tokens = (await client.post("/api/auth/login", json=ADMIN_LOGIN)).json()
+
+    # The new key becomes active; the previous one is kept for verification
+    monkeypatch.setattr(server, "token_signer", TokenSigner(
+        {**old_keys, "2026-10": b"clave-nueva"}, active_kid="2026-10"
+    ))
+    old_headers = {"Authorization": f"Bearer {old_tokens['access_token']}"}
+    assert (await client.get("/api/auth/me", headers=old_headers)).status_code == 200
+    new_tokens = (await client.post("/api/auth/refresh", json={"refresh_token": old_tokens["refresh_token"]})).json()
+    header = json.loads(base64.urlsafe_b64decode(new_tokens["access_token"].split(".")[0] + "=="))
+    assert header["kid"] == "2026-10"
+
+    # Once the previous keys are retired, their tokens stop verifying
+    monkeypatch.setattr(server, "token_signer", TokenSigner(
+        parse_keys("2026-10:clave-nueva", "secreto"), active_kid="2026-10"
+    ))
+    assert (await client.get("/api/auth/me", headers=old_headers)).status_code == 401
+    new_headers = {"Authorization": f"Bearer {new_tokens['access_token']}"}
+    assert (await client.get("/api/auth/me", headers=new_headers)).status_code == 200
+
+
+async def test_secret_key_is_only_a_fallback():
+    legacy = TokenSigner(parse_keys("", "clave-original"))
+    token = legacy.encode({"sub": "cliente@example.com"}, "access", 60)
+
+    assert parse_keys(None, "clave-original") == {DEFAULT_KID: b"clave-original"}
+    # While phasing the old key out it is listed explicitly
+    phasing_out = TokenSigner(parse_keys("default:clave-original,2026a:clave-nueva", "clave-original"), "2026a")
+    assert phasing_out.decode(token)["sub"] == "cliente@example.com"
+    # Once retired, neither its kid nor tokens without a kid verify
+    retired = TokenSigner(parse_keys("2026a:clave-nueva", "clave-original"), "2026a")
+    with pytest.raises(TokenError):
+        retired.decode(token)
+    with pytest.raises(TokenError):
+        retired.decode(signed({"alg": "HS256"}, {"sub": "x", "exp": 4102444800}, secret=b"clave-original"))
@@ -0,0 +1,146 @@
+import asyncio
+import gzip
+
+import brotli
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import compression
+from compression import CompressionMiddleware, accepts
+
+BIG = "garrafón de 20 litros, " * 200
+STREAM_CHUNKS = [f"fila {number}: {BIG}\n" for number in range(3)]
+
+
+async def stream(request):
+    async def chunks():
+        for chunk in STREAM_CHUNKS:
+            yield chunk.encode()
+    return StreamingResponse(chunks(), media_type="text/plain")
+
+
+app = CompressionMiddleware(Starlette(routes=[
+    Route("/big", lambda request: PlainTextResponse(BIG)),
+    Route("/small", lambda request: PlainTextResponse("ok")),
+    Route("/stream", stream),
+    Route("/encoded", lambda request: Response(gzip.compress(BIG.encode()), headers={"Content-Encoding": "gzip"})),
+]), minimum_size=500)
+
+
+async def get(path, accept_encoding):
+    """Raw response, without httpx's automatic decoding"""
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        async with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+            chunks = [chunk async for chunk in response.aiter_raw()]
+    return response, b"".join(chunks), chunks
+
+
+def decode(response, body):
+    encoding = response.headers.get("content-encoding")
+    if encoding == "br":
+        return brotli.decompress(body)
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    return body
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip, deflate, br", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("gzip;q=0.5, br;q=0", "gzip"),
+    ("gzip;q=0", None),
+    ("br;q=0,gzip;q=0", None),
+    ("identity", None),
+    ("", None),
+])
+async def test_encoding_negotiation(accept_encoding, expected):
+    response, body, _ = await get("/big", accept_encoding)
+
+    assert response.headers.get("content-encoding") == expected
+    assert decode(response, body) == BIG.encode()
+    assert int(response.headers["content-length"]) == len(body)
+    if expected:
+        assert "accept-encoding" in response.headers["vary"].lower()
+        assert len(body) < len(BIG.encode()) / 5
+
+
+@pytest.mark.asyncio
+async def test_gzip_fallback_without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+
+    response, body, _ = await get("/big", "br, gzip")
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(body) == BIG.encode()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("accept_encoding", ["br", "gzip"])
+async def test_small_responses_pass_through(accept_encoding):
+    response, body, _ = await get("/small", accept_encoding)
+
+    assert "content-encoding" not in response.headers
+    assert body == b"ok"
+    assert response.headers["content-length"] == "2"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("accept_encoding", ["br", "gzip"])
+async def test_already_encoded_responses_are_not_compressed_twice(accept_encoding):
+    response, body, _ = await get("/encoded", accept_encoding)
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(body) == BIG.encode()
+
+
+async def asgi_messages(path, accept_encoding):
+    """Messages the middleware sends, one per body chunk"""
+    scope = {
+        "type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "scheme": "http", "server": ("test", 80), "http_version": "1.1",
+        "headers": [(b"accept-encoding", accept_encoding.encode())],
+    }
+    messages = []
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        await asyncio.Event().wait()  # the client never disconnects
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("accept_encoding", ["br", "gzip"])
+async def test_streamed_response_is_compressed_chunk_by_chunk(accept_encoding):
+    start, *bodies = await asgi_messages("/stream", accept_encoding)
+    headers = {name.decode(): value.decode() for name, value in start["headers"]}
+    response = httpx.Response(start["status"], headers=headers)
+
+    assert headers["content-encoding"] == accept_encoding
+    assert "content-length" not in headers
+    # One message per source chunk instead of buffering the whole response;
+    # brotli also flushes each chunk (Starlette's gzip may hold bytes back)
+    assert len(bodies) >= len(STREAM_CHUNKS)
+    if accept_encoding == "br":
+        assert all(body["body"] for body in bodies)
+    assert [body.get("more_body", False) for body in bodies][-1] is False
+    assert decode(response, b"".join(body["body"] for body in bodies)) == "".join(STREAM_CHUNKS).encode()
+
+
+def test_accepts():
+    assert accepts("gzip, br;q=0.8", "br")
+    assert accepts("BR", "br")
+    assert not accepts("br;q=0", "br")
+    assert not accepts("br; q=0.0", "br")
+    assert not accepts("br;q=abc", "br")
+    assert not accepts("gzip", "br")
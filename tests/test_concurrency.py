@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+import server
+from tests.conftest import order_payload
+
+pytestmark = pytest.mark.asyncio
+
+
+async def create_coupon(client, admin, code, **limits):
+    response = await client.post("/api/coupons", headers=admin, json={
+        "code": code,
+        "discount_percentage": 10,
+        "expiry_date": "2099-12-31",
+        **limits
+    })
+    assert response.status_code == 200, response.text
+
+
+async def test_coupon_max_uses_holds_under_concurrent_orders(client, admin, register):
+    await create_coupon(client, admin, "AGUA10", max_uses=3)
+    customers = [await register(f"cliente{i}@example.com") for i in range(8)]
+
+    responses = await asyncio.gather(*(
+        client.post("/api/orders", headers=headers, json=order_payload(2, coupon_code="AGUA10"))
+        for headers in customers
+    ))
+
+    assert all(response.status_code == 200 for response in responses)
+    discounted = [response.json() for response in responses if response.json()["coupon_code"] == "AGUA10"]
+    assert len(discounted) == 3
+    assert all(order["final_total"] == 90 for order in discounted)
+    coupons = (await client.get("/api/coupons", headers=admin)).json()
+    assert coupons[0]["current_uses"] == 3
+
+
+async def test_coupon_per_customer_limit_holds_under_concurrent_orders(client, admin, register):
+    await create_coupon(client, admin, "VECINO", per_customer_limit=2)
+    customer = await register("vecino@example.com")
+
+    responses = await asyncio.gather(*(
+        client.post("/api/orders", headers=customer, json=order_payload(1, coupon_code="VECINO"))
+        for _ in range(6)
+    ))
+
+    assert sum(response.json()["coupon_code"] == "VECINO" for response in responses) == 2
+
+
+async def test_concurrent_registration_with_same_email(client):
+    payload = {
+        "email": "duplicado@example.com",
+        "password": "secreto123",
+        "name": "Duplicado",
+        "phone": "8112345678",
+        "address": "Calle 1"
+    }
+
+    responses = await asyncio.gather(*(client.post("/api/auth/register", json=payload) for _ in range(5)))
+
+    assert sorted(response.status_code for response in responses) == [200, 400, 400, 400, 400]
+    assert await server.db.users.count_documents({"email": payload["email"]}) == 1
+
+
+async def test_concurrent_deliver_and_cancel_only_one_wins(client, admin, register):
+    customer = await register("indeciso@example.com")
+    order_id = (await client.post("/api/orders", headers=customer, json=order_payload(3))).json()["id"]
+    await client.put(f"/api/orders/{order_id}/status", headers=admin, json={"status": "in_transit"})
+
+    delivered, cancelled = await asyncio.gather(
+        client.put(f"/api/orders/{order_id}/status", headers=admin, json={"status": "delivered"}),
+        client.put(f"/api/orders/{order_id}/status", headers=admin, json={"status": "cancelled"})
+    )
+
+    assert sorted([delivered.status_code, cancelled.status_code]) == [200, 409]
+    was_delivered = delivered.status_code == 200
+    final_status = (await client.get(f"/api/orders/{order_id}", headers=admin)).json()["status"]
+    assert final_status == ("delivered" if was_delivered else "cancelled")
+    dashboard = (await client.get("/api/me/dashboard", headers=customer)).json()
+    assert dashboard["delivered_orders"] == int(was_delivered)
+    assert dashboard["total_spent"] == (150 if was_delivered else 0)
+
+
+async def test_concurrent_status_updates_apply_side_effects_once(client, admin, register):
+    customer = await register("leal@example.com")
+    order_ids = [
+        (await client.post("/api/orders", headers=customer, json=order_payload(1))).json()["id"]
+        for _ in range(server.LOYALTY_MILESTONE)
+    ]
+
+    for order_id in order_ids:
+        await client.put(f"/api/orders/{order_id}/status", headers=admin, json={"status": "in_transit"})
+
+    # Every order is marked delivered by two admins at once
+    responses = await asyncio.gather(*(
+        client.put(f"/api/orders/{order_id}/status", headers=admin, json={"status": "delivered"})
+        for order_id in order_ids * 2
+    ))
+
+    assert all(response.status_code == 200 for response in responses)
+    loyalty_coupons = (await client.get("/api/coupons/my-coupons", headers=customer)).json()
+    assert [coupon["code"] for coupon in loyalty_coupons] == ["LOYAL5_LEAL"]
+    dashboard = (await client.get("/api/me/dashboard", headers=customer)).json()
+    assert dashboard["delivered_orders"] == server.LOYALTY_MILESTONE
+    assert dashboard["pending_orders"] == 0
+
+    await server.event_outbox.flush()
+    delivered_events = await server.db.events.count_documents({"type": "order.status_changed", "data.to": "delivered"})
+    assert delivered_events == server.LOYALTY_MILESTONE
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def slow_event_writes(client, monkeypatch):
+    """Make every events insert_many take a while; returns the 'started' event"""
+    insert_many = server.db.events.insert_many
+    started = asyncio.Event()
+
+    async def slow_insert_many(documents, **kwargs):
+        started.set()
+        await asyncio.sleep(0.05)
+        return await insert_many(documents, **kwargs)
+
+    monkeypatch.setattr(server.db.events, "insert_many", slow_insert_many)
+    return started
+
+
+def emit(count):
+    for number in range(count):
+        server.event_outbox.emit("test.event", "pruebas", f"sujeto-{number}")
+
+
+async def test_close_waits_for_the_write_in_flight(slow_event_writes):
+    emit(server.event_outbox.flush_size)  # wakes the flush task
+    await asyncio.wait_for(slow_event_writes.wait(), timeout=1)
+    emit(3)  # arrives while the first batch is being written
+
+    await server.event_outbox.close()
+
+    assert await server.db.events.count_documents({"type": "test.event"}) == server.event_outbox.flush_size + 3
+
+
+async def test_batch_cancelled_mid_write_is_requeued(slow_event_writes, monkeypatch):
+    monkeypatch.setattr(server, "OUTBOX_SHUTDOWN_TIMEOUT_SECONDS", 0.01)
+    emit(server.event_outbox.flush_size)
+    await asyncio.wait_for(slow_event_writes.wait(), timeout=1)
+
+    # The deadline passes during the write, so the task is cancelled
+    await server.event_outbox.close()
+
+    assert await server.db.events.count_documents({"type": "test.event"}) == server.event_outbox.flush_size
+
+
+async def test_events_limit_is_validated(client, admin):
+    emit(5)
+    await server.event_outbox.flush()
+
+    response = await client.get("/api/events?type=test.event&limit=2", headers=admin)
+
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert (await client.get("/api/events?limit=0", headers=admin)).status_code == 422
+    assert (await client.get("/api/events?limit=1001", headers=admin)).status_code == 422
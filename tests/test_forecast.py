@@ -0,0 +1,119 @@
+import random
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import pandas as pd
+import pytest
+
+import server
+from forecast import TOTAL_ZONE, UNKNOWN_ZONE, daily_rollup, extract_zones, forecast
+from tests.conftest import order_payload
+
+TODAY = date(2026, 10, 19)  # a Monday
+
+
+def history(weeks, zone_addresses, bottles_by_weekday):
+    """One order per zone and day for `weeks` weeks before TODAY"""
+    orders = []
+    for offset in range(1, 7 * weeks + 1):
+        day = TODAY - timedelta(days=offset)
+        for address in zone_addresses:
+            orders.append({
+                "quantity": bottles_by_weekday[day.weekday()],
+                "delivery_address": address,
+                "delivery_date": day.isoformat()
+            })
+    return orders
+
+
+def test_extract_zones():
+    addresses = pd.Series(["Av. Juárez 10, CP 64000", "Calle 5 C.P. 66450 Apodaca", "Privada 12345, 64720", "Sin datos", None])
+
+    assert extract_zones(addresses).tolist() == ["64000", "66450", "64720", UNKNOWN_ZONE, UNKNOWN_ZONE]
+
+
+def test_steady_weekly_pattern_is_forecast_exactly():
+    pattern = [12, 4, 4, 4, 4, 8, 0]  # busy Mondays and Saturdays
+    rollup = daily_rollup(history(8, ["Calle 1, CP 64000", "Calle 2, CP 66450"], pattern))
+
+    zones = forecast(rollup, TODAY, days=7, weeks=2)
+
+    assert [zone["zone"] for zone in zones] == ["64000", "66450", TOTAL_ZONE]
+    assert [day["bottles"] for day in zones[0]["daily"]] == pattern
+    assert [week["bottles"] for week in zones[0]["weekly"]] == [36, 36]
+    assert [day["bottles"] for day in zones[-1]["daily"]] == [2 * bottles for bottles in pattern]
+    assert zones[0]["weekly"][1]["week_start"] == "2026-10-26"
+
+
+def test_booked_orders_are_a_floor():
+    orders = history(8, ["Calle 1, CP 64000"], [2] * 7)
+    orders.append({"quantity": 30, "delivery_address": "Calle 9, CP 64000", "delivery_date": "2026-10-21"})
+
+    daily = forecast(daily_rollup(orders), TODAY, days=3, weeks=1)[0]["daily"]
+
+    assert [(day["bottles"], day["booked"]) for day in daily] == [(2, 0), (2, 0), (30, 30)]
+
+
+def test_year_of_orders_within_a_second():
+    rng = random.Random(7)
+    addresses = [f"Calle {n}, Col. Centro, CP {64000 + rng.randrange(40) * 10}" for n in range(3000)]
+    orders = [
+        {
+            "quantity": rng.randint(1, 5),
+            "delivery_address": rng.choice(addresses),
+            "delivery_date": (TODAY - timedelta(days=day)).isoformat()
+        }
+        for day in range(365)
+        for _ in range(150)
+    ]
+    daily_rollup(orders[:10])  # pandas import is not part of the budget
+
+    start = time.perf_counter()
+    zones = forecast(daily_rollup(orders), TODAY, days=14, weeks=8)
+    elapsed = time.perf_counter() - start
+
+    assert len(zones) == 41
+    assert elapsed < 1.0, f"forecast over a year of orders took {elapsed:.2f}s"
+
+
+@pytest.mark.asyncio
+async def test_forecast_endpoint_refreshes_incrementally(client, command_log, admin, register):
+    customer = await register("planta@example.com")
+    today = datetime.now(timezone.utc).date()
+    for offset in range(1, 15):
+        await client.post("/api/orders", headers=customer, json=order_payload(
+            2, delivery_date=(today - timedelta(days=offset)).isoformat()
+        ))
+
+    first = await client.get("/api/forecast?days=3&weeks=1", headers=admin)
+    assert first.status_code == 200
+    assert [zone["zone"] for zone in first.json()["zones"]] == ["64000"]
+    assert first.json()["total"]["daily"][1]["booked"] == 0
+
+    tomorrow = (today + timedelta(days=1)).isoformat()
+    booked = (await client.post("/api/orders", headers=customer, json=order_payload(40, delivery_date=tomorrow))).json()
+    command_log.reset()
+    second = (await client.get("/api/forecast?days=3&weeks=1", headers=admin)).json()
+    assert second["total"]["daily"][1] == {"date": tomorrow, "bottles": 40, "booked": 40}
+    assert command_log.collections.count("orders") == 1
+
+    await client.put(f"/api/orders/{booked['id']}/status", headers=admin, json={"status": "cancelled"})
+    third = (await client.get("/api/forecast?days=3&weeks=1", headers=admin)).json()
+    assert third["total"]["daily"][1]["booked"] == 0
+
+    replacement = (await client.post("/api/orders", headers=customer, json=order_payload(25, delivery_date=tomorrow))).json()
+    assert (await client.get("/api/forecast?days=3&weeks=1", headers=admin)).json()["total"]["daily"][1]["booked"] == 25
+    await client.delete(f"/api/orders/{replacement['id']}", headers=admin)
+    fourth = (await client.get("/api/forecast?days=3&weeks=1", headers=admin)).json()
+    assert fourth["total"]["daily"][1]["booked"] == 0
+
+
+@pytest.mark.asyncio
+async def test_forecast_is_admin_only_and_validates_range(client, admin, register):
+    customer = await register("curioso@example.com")
+
+    assert (await client.get("/api/forecast", headers=customer)).status_code == 403
+    empty = (await client.get("/api/forecast", headers=admin)).json()
+    assert empty["zones"] == [] and empty["total"]["weekly"][0]["bottles"] == 0
+    assert (await client.get("/api/forecast?days=0", headers=admin)).status_code == 400
+    assert (await client.get(f"/api/forecast?weeks={server.FORECAST_MAX_WEEKS + 1}", headers=admin)).status_code == 400
@@ -0,0 +1,235 @@
+import json
+
+import pytest
+
+import server
+from tests.test_concurrency import create_coupon
+
+pytestmark = pytest.mark.asyncio
+
+CSV_HEADER = "quantity,delivery_address,delivery_date,delivery_time,notes\n"
+COUPON_HEADER = "quantity,delivery_address,delivery_date,delivery_time,coupon_code\n"
+
+
+async def import_orders(client, headers, body, import_format="csv", piece_size=None):
+    if piece_size:
+        # Stream the body in small pieces, so lines and records straddle network chunks
+        async def pieces():
+            for start in range(0, len(body), piece_size):
+                yield body[start:start + piece_size]
+        content = pieces()
+    else:
+        content = body
+    response = await client.post(
+        f"/api/orders/import?format={import_format}", headers=headers, content=content
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def imported_orders(client, headers):
+    orders = (await client.get("/api/orders", headers=headers)).json()
+    return sorted(orders, key=lambda order: order["quantity"])
+
+
+async def test_csv_import_with_error_report(client, register):
+    customer = await register("oficina@example.com")
+    body = (
+        CSV_HEADER
+        + "2,\"Av. Juárez 10, CP 64000\",2026-11-02,09:00-12:00,Recepción\n"
+        + "0,Calle 1,2026-11-02,09:00-12:00,\n"
+        + "3,Calle 2,2026-11-03,,Sin horario\n"
+        + "4,Calle 3,2026-11-04,12:00-15:00,\n"
+    ).encode()
+
+    report = await import_orders(client, customer, body)
+
+    assert (report["total_rows"], report["imported"], report["failed"]) == (4, 2, 2)
+    assert [error["row"] for error in report["errors"]] == [2, 3]
+    assert report["errors"][0]["errors"][0].startswith("quantity")
+    orders = await imported_orders(client, customer)
+    assert [(order["quantity"], order["delivery_address"]) for order in orders] == [
+        (2, "Av. Juárez 10, CP 64000"), (4, "Calle 3")
+    ]
+
+
+async def test_csv_quoted_cells_can_span_lines(client, register):
+    customer = await register("notas@example.com")
+    body = (
+        CSV_HEADER
+        + '2,Calle 1,2026-11-02,09:00-12:00,"Tocar el timbre\r\nsegundo piso, ""B"""\r\n'
+        + "5,Calle 2,2026-11-02,09:00-12:00,\r\n"
+    ).encode()
+
+    report = await import_orders(client, customer, body, piece_size=7)
+
+    assert (report["total_rows"], report["imported"], report["failed"]) == (2, 2, 0)
+    orders = await imported_orders(client, customer)
+    assert orders[0]["notes"] == 'Tocar el timbre\nsegundo piso, "B"'
+
+
+async def test_quote_inside_unquoted_cell_is_literal(client, register):
+    customer = await register("porton@example.com")
+    body = (
+        CSV_HEADER
+        + '1,Calle 1,2026-11-02,09:00-12:00,Portón de 3/4"\n'
+        + '2,Calle 2,2026-11-02,09:00-12:00,"Tocar ""fuerte"""\n'
+        + "3,Calle 3,2026-11-02,09:00-12:00,\n"
+    ).encode()
+
+    report = await import_orders(client, customer, body)
+
+    assert (report["total_rows"], report["imported"], report["failed"]) == (3, 3, 0)
+    orders = await imported_orders(client, customer)
+    assert [order["notes"] for order in orders] == ['Portón de 3/4"', 'Tocar "fuerte"', ""]
+
+
+async def test_non_utf8_rows_are_reported_not_mangled(client, register):
+    customer = await register("excel@example.com")
+    body = (
+        CSV_HEADER.encode()
+        + "1,Av. Constitución 100,2026-11-02,09:00-12:00,\n".encode("cp1252")
+        + "2,Calle 2,2026-11-02,09:00-12:00,\n".encode()
+    )
+
+    report = await import_orders(client, customer, body)
+
+    assert (report["imported"], report["failed"]) == (1, 1)
+    assert report["errors"][0]["row"] == 1
+    assert "UTF-8" in report["errors"][0]["errors"][0]
+
+
+async def test_ndjson_import(client, register):
+    customer = await register("ndjson@example.com")
+    rows = [
+        json.dumps({"quantity": 3, "delivery_address": "Calle 1", "delivery_date": "2026-11-02", "delivery_time": "09:00"}),
+        "{no es json",
+        json.dumps([1, 2]),
+        "",
+        json.dumps({"quantity": 1, "delivery_address": "Calle 2", "delivery_date": "2026-11-02", "delivery_time": "09:00"}),
+    ]
+
+    report = await import_orders(client, customer, "\n".join(rows).encode(), "ndjson")
+
+    assert (report["total_rows"], report["imported"], report["failed"]) == (4, 2, 2)
+    assert [error["row"] for error in report["errors"]] == [2, 3]
+
+
+async def test_rows_spanning_chunk_boundaries(client, register, monkeypatch):
+    monkeypatch.setattr(server, "IMPORT_CHUNK_SIZE", 4)
+    customer = await register("lotes@example.com")
+    lines = [f"{quantity},Calle {quantity},2026-11-02,09:00-12:00,\"nota\n{quantity}\"\n" for quantity in range(1, 11)]
+    lines[5] = "0,Calle 6,2026-11-02,09:00-12:00,\n"
+
+    report = await import_orders(client, customer, (CSV_HEADER + "".join(lines)).encode(), piece_size=13)
+
+    assert (report["total_rows"], report["imported"], report["failed"]) == (10, 9, 1)
+    assert report["errors"][0]["row"] == 6
+    orders = await imported_orders(client, customer)
+    assert [order["quantity"] for order in orders] == [1, 2, 3, 4, 5, 7, 8, 9, 10]
+    assert orders[-1]["notes"] == "nota\n10"
+
+
+async def test_oversized_rows_are_skipped(client, register, monkeypatch):
+    monkeypatch.setattr(server, "IMPORT_MAX_ROW_BYTES", 256)
+    customer = await register("grande@example.com")
+    body = (
+        CSV_HEADER
+        + "1,Calle 1,2026-11-02,09:00-12:00," + "x" * 1000 + "\n"
+        + '2,Calle 2,2026-11-02,09:00-12:00,"' + "sin cerrar\n" * 40
+        + "3,Calle 3,2026-11-02,09:00-12:00,\n"
+    ).encode()
+
+    report = await import_orders(client, customer, body, piece_size=64)
+
+    assert report["imported"] == 1
+    assert report["failed"] >= 2
+    assert [order["quantity"] for order in await imported_orders(client, customer)] == [3]
+
+
+async def test_body_without_newlines_is_bounded(client, register, monkeypatch):
+    monkeypatch.setattr(server, "IMPORT_MAX_ROW_BYTES", 256)
+    customer = await register("flujo@example.com")
+
+    report = await import_orders(client, customer, b'{"quantity": 1, "notes": "' + b"x" * 100_000, "ndjson", piece_size=4096)
+
+    assert (report["total_rows"], report["imported"], report["failed"]) == (1, 0, 1)
+    assert "demasiado larga" in report["errors"][0]["errors"][0]
+
+
+def coupon_rows(count, code):
+    return (COUPON_HEADER + "".join(
+        f"{quantity},Calle {quantity},2026-11-02,09:00-12:00,{code}\n" for quantity in range(1, count + 1)
+    )).encode()
+
+
+async def stored_coupon(code):
+    return await server.db.coupons.find_one({"code": code}, {"_id": 0})
+
+
+async def test_import_respects_coupon_limits(client, admin, register):
+    await create_coupon(client, admin, "LOTE", max_uses=3)
+    customer = await register("limite@example.com")
+
+    report = await import_orders(client, customer, coupon_rows(5, "lote"))
+
+    assert report["imported"] == 5
+    orders = await imported_orders(client, customer)
+    assert [order["coupon_code"] for order in orders] == ["LOTE"] * 3 + [None] * 2
+    assert orders[0]["final_total"] == 45 and orders[4]["final_total"] == 250
+    assert (await stored_coupon("LOTE"))["current_uses"] == 3
+
+
+async def test_import_reprices_when_coupon_was_used_elsewhere(client, admin, register):
+    await create_coupon(client, admin, "COMPARTIDO", max_uses=3)
+    await create_coupon(client, admin, "PORCLIENTE", per_customer_limit=2)
+    customer = await register("tarde@example.com")
+    key = server.customer_key("tarde@example.com")
+    await server.coupon_engine.get("COMPARTIDO")  # warm this worker's cache
+    # Other workers used the coupons after this worker cached them
+    await server.db.coupons.update_one({"code": "COMPARTIDO"}, {"$set": {"current_uses": 2}})
+    await server.db.coupons.update_one({"code": "PORCLIENTE"}, {"$set": {f"redemptions.{key}": 1}})
+
+    await import_orders(client, customer, coupon_rows(3, "COMPARTIDO"))
+    await import_orders(client, customer, coupon_rows(3, "PORCLIENTE"))
+
+    orders = await imported_orders(client, customer)
+    assert sorted(order["coupon_code"] or "" for order in orders) == ["", "", "", "", "COMPARTIDO", "PORCLIENTE"]
+    assert (await stored_coupon("COMPARTIDO"))["current_uses"] == 3
+    assert (await stored_coupon("PORCLIENTE"))["redemptions"][key] == 2
+
+
+async def test_rows_that_fail_to_insert_do_not_use_the_coupon(client, admin, register, monkeypatch):
+    await create_coupon(client, admin, "FALLA", max_uses=10, per_customer_limit=5)
+    customer = await register("falla@example.com")
+    insert_many = server.db.orders.insert_many
+
+    async def first_row_taken(documents, **kwargs):
+        await server.db.orders.insert_one(dict(documents[0], customer_email="otro@example.com"))
+        return await insert_many(documents, **kwargs)
+
+    monkeypatch.setattr(server.db.orders, "insert_many", first_row_taken)
+    report = await import_orders(client, customer, coupon_rows(3, "FALLA"))
+
+    assert (report["imported"], report["failed"]) == (2, 1)
+    coupon = await stored_coupon("FALLA")
+    assert coupon["current_uses"] == 2
+    assert coupon["redemptions"][server.customer_key("falla@example.com")] == 2
+
+
+async def test_coupon_removed_after_a_failed_claim_is_not_applied(client, admin, register, monkeypatch):
+    await create_coupon(client, admin, "GONE10", max_uses=5)
+    customer = await register("borrado@example.com")
+    claim = server.coupon_engine.claim_bulk_redemptions
+
+    async def deleted_meanwhile(compiled, uses):
+        # Another admin deletes the coupon between pricing and the claim
+        await server.db.coupons.delete_one({"code": "GONE10"})
+        return await claim(compiled, uses)
+
+    monkeypatch.setattr(server.coupon_engine, "claim_bulk_redemptions", deleted_meanwhile)
+    report = await import_orders(client, customer, coupon_rows(1, "GONE10"))
+
+    assert (report["imported"], report["failed"]) == (1, 0)
+    orders = await imported_orders(client, customer)
+    assert [(order["coupon_code"], order["final_total"]) for order in orders] == [(None, 50)]
@@ -0,0 +1,31 @@
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+import server
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_app_starts_on_a_database_with_legacy_duplicates(database, monkeypatch):
+    # Written by the old check-then-insert code paths before the unique indexes existed
+    await database.users.insert_many([
+        {"email": "doble@example.com", "name": "Primero", "role": "customer"},
+        {"email": "doble@example.com", "name": "Segundo", "role": "customer"},
+    ])
+    await database.coupons.insert_many([{"code": "AGUA10"}, {"code": "AGUA10"}, {"code": "AGUA10"}])
+    errors = []
+    monkeypatch.setattr(server.logger, "error", errors.append)
+    monkeypatch.setattr(server, "db", None)
+    app = server.create_app(database=database)
+
+    async with app.router.lifespan_context(app):
+        # The conflicting indexes are skipped, the others are still created
+        await database.users.insert_one({"email": "doble@example.com", "name": "Tercero"})
+        await database.orders.insert_one({"id": "pedido-1"})
+        with pytest.raises(DuplicateKeyError):
+            await database.orders.insert_one({"id": "pedido-1"})
+
+    assert errors == [
+        "Unique index on users.email not created, duplicate values: 'doble@example.com' (2)",
+        "Unique index on coupons.code not created, duplicate values: 'AGUA10' (3)",
+    ]
@@ -0,0 +1,110 @@
+import pytest
+
+import server
+from tests.conftest import order_payload
+
+
+def rows_from_columnar(payload):
+    """Inverse of server.columnar: back to one dict per row"""
+    columns = {
+        name: [column["values"][index] for index in column["indexes"]] if isinstance(column, dict) else column
+        for name, column in payload["columns"].items()
+    }
+    return [{name: values[row] for name, values in columns.items()} for row in range(payload["count"])]
+
+
+@pytest.fixture
+def find_projections(client, monkeypatch):
+    """Record the projection of every find on the collection"""
+    def spy(collection):
+        projections = []
+        find = collection.find
+
+        def recording_find(filter=None, projection=None, **kwargs):
+            projections.append(projection)
+            return find(filter, projection, **kwargs)
+
+        monkeypatch.setattr(collection, "find", recording_find)
+        return projections
+    return spy
+
+
+async def place_orders(client, register):
+    customers = [await register(f"lista{number}@example.com", name=f"Cliente {number}") for number in range(2)]
+    for quantity in range(1, 7):
+        await client.post("/api/orders", headers=customers[quantity % 2], json=order_payload(quantity))
+
+
+@pytest.mark.asyncio
+async def test_sparse_fields_are_projected_in_mongo(client, admin, register, find_projections):
+    await place_orders(client, register)
+    projections = find_projections(server.db.orders)
+
+    response = await client.get("/api/orders?fields=id,status,quantity", headers=admin)
+
+    assert response.status_code == 200
+    assert projections == [{"_id": 0, "id": 1, "status": 1, "quantity": 1}]
+    assert [set(order) for order in response.json()] == [{"id", "status", "quantity"}] * 6
+    assert [order["quantity"] for order in response.json()] == [6, 5, 4, 3, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_customer_fields_are_projected_in_mongo(client, admin, register, find_projections):
+    await place_orders(client, register)
+    projections = find_projections(server.db.users)
+
+    response = await client.get("/api/customers?fields=name,total_orders", headers=admin)
+
+    assert projections == [{"_id": 0, "email": 1, "name": 1}]
+    assert sorted(map(tuple, (row.values() for row in response.json()))) == [("Cliente 0", 3), ("Cliente 1", 3)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fields", ["", ",", " , ", "id,precio", "password"])
+async def test_invalid_fields_are_rejected(client, admin, fields):
+    for path in ("/api/orders", "/api/customers"):
+        response = await client.get(f"{path}?fields={fields}", headers=admin)
+        assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fields", [None, "id,status,customer_name,final_total,notes"])
+async def test_columnar_decodes_to_the_json_rows(client, admin, register, fields):
+    await place_orders(client, register)
+    query = f"&fields={fields}" if fields else ""
+
+    rows = (await client.get(f"/api/orders?format=json{query}", headers=admin)).json()
+    payload = (await client.get(f"/api/orders?format=columnar{query}", headers=admin)).json()
+
+    assert payload["count"] == 6
+    assert rows_from_columnar(payload) == rows
+    # Repeated strings are sent once per distinct value
+    assert payload["columns"]["status"] == {"values": ["pending"], "indexes": [0] * 6}
+    assert sorted(payload["columns"]["customer_name"]["values"]) == ["Cliente 0", "Cliente 1"]
+    assert isinstance(payload["columns"]["id"], list)
+
+
+@pytest.mark.asyncio
+async def test_customers_columnar_decodes_to_the_json_rows(client, admin, register):
+    await place_orders(client, register)
+
+    rows = (await client.get("/api/customers", headers=admin)).json()
+    payload = (await client.get("/api/customers?format=columnar", headers=admin)).json()
+
+    assert rows_from_columnar(payload) == rows
+
+
+def test_columnar_keeps_mostly_distinct_columns_plain():
+    rows = [
+        {"code": code, "kind": kind, "uses": uses}
+        for code, kind, uses in [("A", "x", 1), ("B", "x", None), ("C", None, 3), ("D", "x", 4)]
+    ]
+
+    payload = server.columnar(rows, ["code", "kind", "uses"])
+
+    assert payload["columns"] == {
+        "code": ["A", "B", "C", "D"],
+        "kind": {"values": ["x", None], "indexes": [0, 0, 1, 0]},
+        "uses": [1, None, 3, 4],
+    }
+    assert rows_from_columnar(payload) == rows
@@ -0,0 +1,84 @@
+import pytest
+import pytest_asyncio
+
+import server
+from tests.conftest import order_payload
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest_asyncio.fixture
+async def order_id(client, register):
+    customer = await register("estado@example.com")
+    response = await client.post("/api/orders", headers=customer, json=order_payload(2))
+    return response.json()["id"]
+
+
+async def set_status(client, admin, order_id, new_status):
+    return await client.put(f"/api/orders/{order_id}/status", headers=admin, json={"status": new_status})
+
+
+async def test_order_moves_through_the_lifecycle(client, admin, order_id):
+    for new_status in ("in_transit", "delivered"):
+        response = await set_status(client, admin, order_id, new_status)
+        assert response.status_code == 200
+        assert response.json()["status"] == new_status
+
+
+@pytest.mark.parametrize("path, rejected", [
+    ((), "delivered"),
+    (("in_transit",), "pending"),
+    (("in_transit", "delivered"), "cancelled"),
+    (("cancelled",), "in_transit"),
+])
+async def test_invalid_transitions_are_rejected(client, admin, order_id, path, rejected):
+    for new_status in path:
+        assert (await set_status(client, admin, order_id, new_status)).status_code == 200
+
+    response = await set_status(client, admin, order_id, rejected)
+
+    assert response.status_code == 409
+    order = (await client.get(f"/api/orders/{order_id}", headers=admin)).json()
+    assert order["status"] == (path[-1] if path else "pending")
+
+
+async def test_repeating_the_current_status_is_a_no_op(client, admin, order_id):
+    await set_status(client, admin, order_id, "in_transit")
+    response = await set_status(client, admin, order_id, "in_transit")
+
+    assert response.status_code == 200
+    await server.event_outbox.flush()
+    assert await server.db.events.count_documents({"type": "order.status_changed", "subject": order_id}) == 1
+
+
+async def test_unknown_order_and_unknown_status(client, admin, order_id):
+    assert (await set_status(client, admin, "no-existe", "in_transit")).status_code == 404
+    assert (await set_status(client, admin, order_id, "lost")).status_code == 422
+
+
+async def test_transition_is_a_single_order_command(client, command_log, admin, order_id):
+    command_log.reset()
+    await set_status(client, admin, order_id, "in_transit")
+
+    assert command_log.collections.count("orders") == 1
+
+
+async def test_hooks_run_for_their_status_and_failures_are_isolated(client, admin, order_id, monkeypatch):
+    monkeypatch.setattr(server, "order_status_hooks", {
+        status: list(hooks) for status, hooks in server.order_status_hooks.items()
+    })
+    calls = []
+
+    @server.on_order_status("cancelled")
+    async def failing_hook(order, previous_status, actor):
+        raise RuntimeError("notification service down")
+
+    @server.on_order_status("cancelled")
+    async def notify(order, previous_status, actor):
+        calls.append((order["id"], previous_status, order["status"], actor))
+
+    await set_status(client, admin, order_id, "in_transit")
+    response = await set_status(client, admin, order_id, "cancelled")
+
+    assert response.status_code == 200
+    assert calls == [(order_id, "in_transit", "cancelled", "admin@acqua.com")]
@@ -0,0 +1,65 @@
+"""Database round trips per request must not grow with the data set.
+
+Each test measures a request with a small and a larger data set and expects
+the same number of database commands, so an N+1 loop shows up as a failure
+regardless of the exact count.
+"""
+import pytest
+
+from tests.conftest import order_payload
+
+pytestmark = pytest.mark.asyncio
+
+
+async def count_commands(client, command_log, method, url, headers, **kwargs):
+    command_log.reset()
+    response = await client.request(method, url, headers=headers, **kwargs)
+    assert response.status_code == 200, response.text
+    return len(command_log)
+
+
+async def add_customers(client, register, start, count):
+    for index in range(start, start + count):
+        customer = await register(f"cliente{index}@example.com")
+        await client.post("/api/orders", headers=customer, json=order_payload(1))
+        await client.post("/api/orders", headers=customer, json=order_payload(2))
+
+
+async def test_customer_list_is_constant(client, command_log, admin, register):
+    await add_customers(client, register, 0, 2)
+    small = await count_commands(client, command_log, "GET", "/api/customers", admin)
+    await add_customers(client, register, 2, 8)
+    large = await count_commands(client, command_log, "GET", "/api/customers", admin)
+
+    assert large == small <= 3
+
+
+async def test_order_list_is_constant(client, command_log, admin, register):
+    await add_customers(client, register, 0, 2)
+    small = await count_commands(client, command_log, "GET", "/api/orders", admin)
+    await add_customers(client, register, 2, 8)
+    large = await count_commands(client, command_log, "GET", "/api/orders", admin)
+
+    assert large == small <= 2
+
+
+async def test_dashboard_is_constant(client, command_log, register):
+    customer = await register("frecuente@example.com")
+    await client.post("/api/orders", headers=customer, json=order_payload(1))
+    await client.get("/api/me/dashboard", headers=customer)  # loads the coupon cache
+    small = await count_commands(client, command_log, "GET", "/api/me/dashboard", customer)
+    for quantity in range(1, 30):
+        await client.post("/api/orders", headers=customer, json=order_payload(quantity))
+    large = await count_commands(client, command_log, "GET", "/api/me/dashboard", customer)
+
+    assert large == small <= 2
+
+
+async def test_order_creation_is_constant(client, command_log, register):
+    customer = await register("nuevo@example.com")
+    first = await count_commands(client, command_log, "POST", "/api/orders", customer, json=order_payload(1))
+    for _ in range(10):
+        await client.post("/api/orders", headers=customer, json=order_payload(1))
+    later = await count_commands(client, command_log, "POST", "/api/orders", customer, json=order_payload(1))
+
+    assert later == first <= 3
@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from startup_profile import DEFERRED_MODULES, STARTUP_BUDGET_SECONDS, measure_import
+
+
+def test_import_within_startup_budget():
+    # Best of three, so a single slow run on a busy machine does not fail the suite
+    elapsed = min(measure_import()[0] for _ in range(3))
+    assert elapsed < STARTUP_BUDGET_SECONDS, (
+        f"import server took {elapsed:.3f}s, budget is {STARTUP_BUDGET_SECONDS}s; "
+        "run `python backend/startup_profile.py` for the breakdown"
+    )
+
+
+def test_heavy_dependencies_are_deferred():
+    _, modules = measure_import()
+    loaded = [name for name in DEFERRED_MODULES if name in modules]
+    assert not loaded, f"imported at startup instead of on first use: {loaded}"
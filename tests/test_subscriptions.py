@@ -0,0 +1,120 @@
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.asyncio
+
+
+def subscription_document(number, next_delivery_date, cadence="weekly"):
+    return {
+        "id": str(uuid.uuid4()),
+        "customer_email": f"suscriptor{number % 50}@example.com",
+        "customer_name": f"Suscriptor {number % 50}",
+        "customer_phone": "8112345678",
+        "quantity": 1 + number % 4,
+        "delivery_address": f"Calle {number}, CP 64000",
+        "delivery_time": "09:00-12:00",
+        "cadence": cadence,
+        "notes": "",
+        "is_active": True,
+        "next_delivery_date": next_delivery_date.isoformat(),
+        "next_run_at": server.subscription_run_at(next_delivery_date),
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+
+async def seed_due_subscriptions(count, now):
+    tomorrow = now.date() + timedelta(days=1)
+    subscriptions = [subscription_document(number, tomorrow) for number in range(count)]
+    await server.db.subscriptions.insert_many([dict(subscription) for subscription in subscriptions])
+    return subscriptions
+
+
+async def test_materialising_twice_creates_each_order_once(client):
+    now = datetime.now(timezone.utc)
+    subscriptions = await seed_due_subscriptions(5, now)
+
+    assert await server.materialise_due_subscriptions(now) == 5
+    assert await server.materialise_due_subscriptions(now) == 0
+
+    assert await server.db.orders.count_documents({}) == 5
+    stored = await server.db.subscriptions.find({}, {"_id": 0}).to_list(None)
+    next_delivery = (now.date() + timedelta(days=8)).isoformat()
+    assert {subscription["next_delivery_date"] for subscription in stored} == {next_delivery}
+    assert all(subscription["next_run_at"] > now.isoformat() for subscription in stored)
+    assert {order["subscription_id"] for order in await server.db.orders.find({}).to_list(None)} == {
+        subscription["id"] for subscription in subscriptions
+    }
+
+
+async def test_run_interrupted_before_advancing_is_replayed_safely(client, monkeypatch):
+    now = datetime.now(timezone.utc)
+    await seed_due_subscriptions(5, now)
+    bulk_write = server.db.subscriptions.bulk_write
+
+    async def crash(*args, **kwargs):
+        raise ConnectionError("scheduler lost the connection")
+
+    monkeypatch.setattr(server.db.subscriptions, "bulk_write", crash)
+    with pytest.raises(ConnectionError):
+        await server.materialise_due_subscriptions(now)
+    monkeypatch.setattr(server.db.subscriptions, "bulk_write", bulk_write)
+
+    assert await server.materialise_due_subscriptions(now) == 0
+    assert await server.db.orders.count_documents({}) == 5
+    assert await server.db.subscriptions.count_documents({"next_run_at": {"$lte": now.isoformat()}}) == 0
+
+
+async def test_orders_from_an_interrupted_run_reach_the_summary(client, register, monkeypatch):
+    customer = await register("suscrito@example.com")
+    now = datetime.now(timezone.utc)
+    tomorrow = (now.date() + timedelta(days=1)).isoformat()
+    response = await client.post("/api/subscriptions", headers=customer, json={
+        "quantity": 2, "delivery_address": "Calle 1, CP 64000", "delivery_time": "09:00-12:00", "start_date": tomorrow
+    })
+    assert response.status_code == 200
+    summary_record_orders = server.summary_record_orders
+
+    async def crash(orders):
+        raise ConnectionError("scheduler lost the connection")
+
+    monkeypatch.setattr(server, "summary_record_orders", crash)
+    with pytest.raises(ConnectionError):
+        await server.materialise_due_subscriptions(now)
+    monkeypatch.setattr(server, "summary_record_orders", summary_record_orders)
+
+    assert await server.materialise_due_subscriptions(now) == 0
+    dashboard = (await client.get("/api/me/dashboard", headers=customer)).json()
+    assert dashboard["total_orders"] == 1
+    assert dashboard["recent_orders"][0]["delivery_date"] == tomorrow
+
+
+async def test_missed_occurrences_are_skipped(client):
+    now = datetime.now(timezone.utc)
+    three_weeks_ago = now.date() - timedelta(days=21)
+    await server.db.subscriptions.insert_one(subscription_document(1, three_weeks_ago))
+
+    assert await server.materialise_due_subscriptions(now) == 1
+    stored = await server.db.subscriptions.find_one({}, {"_id": 0})
+    assert stored["next_run_at"] > now.isoformat()
+    assert await server.materialise_due_subscriptions(now) == 0
+
+
+async def test_large_due_set_is_materialised_in_batches(client, command_log, monkeypatch):
+    monkeypatch.setattr(server, "SUBSCRIPTION_BATCH_SIZE", 500)
+    now = datetime.now(timezone.utc)
+    await seed_due_subscriptions(5000, now)
+    command_log.reset()
+
+    start = time.perf_counter()
+    assert await server.materialise_due_subscriptions(now) == 5000
+    elapsed = time.perf_counter() - start
+
+    # Per batch: one find, one insert_many, one bulk_write; plus the final empty find
+    assert command_log.collections.count("subscriptions") == 2 * 10 + 1
+    assert command_log.collections.count("orders") == 10
+    assert elapsed < 5.0, f"materialising 5000 subscriptions took {elapsed:.2f}s"
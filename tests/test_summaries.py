@@ -0,0 +1,64 @@
+import pytest
+
+import server
+from tests.conftest import order_payload
+from tests.test_import import COUPON_HEADER, import_orders
+
+pytestmark = pytest.mark.asyncio
+
+
+async def stored_summary(customer_email):
+    return await server.db.customer_summaries.find_one({"customer_email": customer_email}, {"_id": 0})
+
+
+async def dashboard(client, headers):
+    response = await client.get("/api/me/dashboard", headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+async def test_rebuild_does_not_overwrite_concurrent_writes(client, register):
+    customer = await register("carrera@example.com")
+    await client.post("/api/orders", headers=customer, json=order_payload(2))
+    await server.summary_mark_stale("carrera@example.com")
+    version_at_read = (await stored_summary("carrera@example.com"))["version"]
+
+    # An order lands after the rebuild read the version
+    await client.post("/api/orders", headers=customer, json=order_payload(3))
+    await server.rebuild_customer_summary("carrera@example.com", version_at_read)
+
+    summary = await stored_summary("carrera@example.com")
+    assert summary["needs_rebuild"] is True
+    assert summary["version"] > version_at_read
+    assert (await dashboard(client, customer))["total_orders"] == 2
+    assert (await stored_summary("carrera@example.com"))["needs_rebuild"] is False
+
+
+async def test_summaries_written_before_versioning_are_rebuilt(client, register):
+    customer = await register("antiguo@example.com")
+    await client.post("/api/orders", headers=customer, json=order_payload(4))
+    await server.db.customer_summaries.update_one(
+        {"customer_email": "antiguo@example.com"},
+        {"$set": {"needs_rebuild": True, "total_orders": 99}, "$unset": {"version": ""}}
+    )
+
+    assert (await dashboard(client, customer))["total_orders"] == 1
+    summary = await stored_summary("antiguo@example.com")
+    assert (summary["needs_rebuild"], summary["version"]) == (False, 0)
+
+
+async def test_duplicate_import_rows_mark_the_summary_stale(client, register, monkeypatch):
+    customer = await register("reintento@example.com")
+    insert_many = server.db.orders.insert_many
+
+    async def saved_by_an_earlier_attempt(documents, **kwargs):
+        # A previous attempt saved the first order but died before its summary update
+        await server.db.orders.insert_one(dict(documents[0]))
+        return await insert_many(documents, **kwargs)
+
+    monkeypatch.setattr(server.db.orders, "insert_many", saved_by_an_earlier_attempt)
+    body = (COUPON_HEADER + "1,Calle 1,2026-11-02,09:00-12:00,\n2,Calle 2,2026-11-02,09:00-12:00,\n").encode()
+    report = await import_orders(client, customer, body)
+
+    assert (report["imported"], report["failed"]) == (1, 1)
+    assert (await dashboard(client, customer))["total_orders"] == 2